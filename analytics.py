@@ -0,0 +1,198 @@
+# duration analytics over every entry, answered from numpy arrays
+#
+#   python analytics.py --percentiles 50 90 99
+#   python analytics.py --histogram 30 --from 01/01/17 --to 31/12/17
+#   python analytics.py --employees
+#   python analytics.py --outliers 3
+#
+# The id, employee id, start and time taken of every entry (archives
+# included) are read in one pass into a snapshot. The snapshot is saved
+# as a .npy file named after the newest change in the change log, and
+# memory mapped by later runs until the entries change again.
+import argparse
+import datetime
+import glob
+import itertools
+import os
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from peewee import fn
+
+from constants import Constants
+import reports
+import worklog
+from worklog import Employee, Entry, worklog_db
+
+
+COLUMNS = ('id', 'employee', 'date_started', 'time_taken')
+
+
+def snapshot_path(seq):
+    '''the cache file of the snapshot taken when seq was the newest change'''
+    return '{}_durations_{}.npy'.format(os.path.splitext(worklog_db.database)[0], seq)
+
+
+def read_columns():
+    '''every entry as a 4 x n int64 array of COLUMNS, in one bulk read'''
+    query = Entry.select(Entry.id, fn.IFNULL(Entry.employee, 0),
+                         Entry.date_started, Entry.time_taken)
+    values = []
+    for schema in worklog.search_partitions():
+        with worklog.partition(schema):
+            sql, params = query.sql()
+        # flattened straight into the array, rows never become objects
+        values.append(numpy.fromiter(itertools.chain.from_iterable(
+            worklog_db.execute_sql(sql, params)), dtype=numpy.int64))
+    return numpy.concatenate(values).reshape(-1, len(COLUMNS)).T.copy()
+
+
+class DurationSnapshot:
+    '''
+    the entries as columns - id, employee (0 for none), date_started
+    (epoch seconds) and time_taken (seconds) - with vectorised answers
+    to the questions find_by_duration cannot ask
+    '''
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.id, self.employee, self.date_started, self.time_taken = columns
+
+    @classmethod
+    def load(cls, cache=True):
+        '''
+        the snapshot of the entries as they are now, memory mapped from
+        its cache file when the change log has not moved since it was
+        saved, otherwise read from the database (and saved if cache)
+        '''
+        if numpy is None:
+            raise RuntimeError('Duration analytics need numpy, pip install numpy')
+        path = snapshot_path(worklog.last_change())
+        if cache and os.path.exists(path):
+            return cls(numpy.load(path, mmap_mode='r'))
+
+        columns = read_columns()
+        if cache:
+            for stale in glob.glob(snapshot_path('*')):
+                os.remove(stale)
+            with open(path + '.tmp', 'wb') as snapshot_file:
+                numpy.save(snapshot_file, columns)
+            os.replace(path + '.tmp', path)
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.id)
+
+    def between(self, first_day=None, last_day=None, employee_id=None):
+        '''the entries started from first_day to last_day, and by an employee'''
+        keep = numpy.ones(len(self), dtype=bool)
+        start, end = worklog.day_range(first_day or datetime.date.min,
+                                       last_day or datetime.date.max)
+        if first_day:
+            keep &= self.date_started >= Entry.date_started.db_value(start)
+        if last_day:
+            keep &= self.date_started <= Entry.date_started.db_value(end)
+        if employee_id is not None:
+            keep &= self.employee == employee_id
+        return DurationSnapshot(self.columns[:, keep])
+
+    def percentiles(self, percents=Constants.ANALYTICS_PERCENTILES):
+        '''{percent: time taken in seconds} over the entries'''
+        if not len(self):
+            return {}
+        return dict(zip(percents, numpy.percentile(self.time_taken, percents).tolist()))
+
+    def histogram(self, minutes=Constants.HISTOGRAM_MINUTES):
+        '''
+        (band start in minutes, number of entries, total seconds) for
+        each band of time taken minutes wide, the same rows as
+        reports.duration_histogram
+        '''
+        bands = self.time_taken // (minutes * 60)
+        counts = numpy.bincount(bands)
+        totals = numpy.bincount(bands, weights=self.time_taken)
+        return [(band * minutes, int(counts[band]), int(totals[band]))
+                for band in numpy.flatnonzero(counts).tolist()]
+
+    def employee_totals(self):
+        '''{employee id: (total seconds, number of entries)}'''
+        counts = numpy.bincount(self.employee)
+        totals = numpy.bincount(self.employee, weights=self.time_taken)
+        return {employee_id: (int(totals[employee_id]), int(counts[employee_id]))
+                for employee_id in numpy.flatnonzero(counts).tolist()}
+
+    def outliers(self, iqrs=Constants.OUTLIER_IQRS):
+        '''
+        the ids of the entries that took more than iqrs interquartile
+        ranges longer than the upper quartile, longest first
+        '''
+        if not len(self):
+            return []
+        lower, upper = numpy.percentile(self.time_taken, (25, 75))
+        longer = numpy.flatnonzero(self.time_taken > upper + iqrs * (upper - lower))
+        longest_first = longer[numpy.argsort(-self.time_taken[longer], kind='stable')]
+        return self.id[longest_first].tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Duration analytics over every '
+                                     'entry, needs numpy')
+    parser.add_argument('--percentiles', type=float, nargs='*', metavar='PERCENT',
+                        help='time taken at these percentiles, by default {}'
+                        .format(' '.join(map(str, Constants.ANALYTICS_PERCENTILES))))
+    parser.add_argument('--histogram', type=int, nargs='?', metavar='MINUTES',
+                        const=Constants.HISTOGRAM_MINUTES,
+                        help='number of entries per band of time taken')
+    parser.add_argument('--employees', action='store_true',
+                        help='total time and entries per employee')
+    parser.add_argument('--outliers', type=float, nargs='?', metavar='IQRS',
+                        const=Constants.OUTLIER_IQRS,
+                        help='entries taking unusually long')
+    parser.add_argument('--employee', help='full name of the employee')
+    parser.add_argument('--from', dest='date_from', metavar='DD/MM/YY')
+    parser.add_argument('--to', dest='date_to', metavar='DD/MM/YY')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='read the database and do not save the snapshot')
+    args = parser.parse_args(argv)
+
+    try:
+        first_day = worklog.parse_day(args.date_from) if args.date_from else None
+        last_day = worklog.parse_day(args.date_to) if args.date_to else None
+    except ValueError as error:
+        parser.error(str(error).strip())
+    if numpy is None:
+        parser.error('duration analytics need numpy, pip install numpy')
+
+    employee_id = None
+    if args.employee:
+        employee = Employee.get_or_none(Employee.name_key ==
+                                        worklog.employee_key(args.employee))
+        employee_id = employee.id if employee else -1
+    snapshot = DurationSnapshot.load(not args.no_cache).between(first_day, last_day,
+                                                                employee_id)
+
+    if args.histogram:
+        reports.print_histogram(snapshot.histogram(args.histogram), args.histogram)
+    elif args.employees:
+        names = dict(Employee.select(Employee.id, Employee.name).tuples())
+        rows = sorted((names.get(employee_id, ''), seconds, count)
+                      for employee_id, (seconds, count) in snapshot.employee_totals().items())
+        print('{:<30} {:>10} {:>8}'.format('Employee Name', 'Hours', 'Entries'))
+        for name, seconds, count in rows:
+            print('{:<30} {:>10} {:>8}'.format(name, reports.format_hours(seconds), count))
+    elif args.outliers:
+        entry_ids = snapshot.outliers(args.outliers)
+        print('{} entries took unusually long: {}'.format(
+            len(entry_ids), ' '.join(map(str, entry_ids))))
+    else:
+        percents = args.percentiles or Constants.ANALYTICS_PERCENTILES
+        for percent, seconds in snapshot.percentiles(percents).items():
+            print('{:>6g}%  {:>8.1f} minutes'.format(percent, seconds / 60))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,386 @@
+# json api over the work log, for dashboards and other tools
+#
+#   GET    /entries?employee=&from=&to=&minutes=&lookup=&pattern=&limit=&after=
+#   GET    /entries?...&stream=1      every match as json lines, chunked
+#   GET    /entries/<id>              one entry including its notes
+#   POST   /entries                   add an entry, same keys as the importer
+#   DELETE /entries/<id>
+#   GET    /summaries?period=&employee=&from=&to=&limit=&page=
+#   GET    /cache                     search cache hits, misses and evictions
+#   GET    /changes?after=&limit=     the change log after a seq, oldest first
+#
+# Requests are served by asyncio; the queries run on a bounded pool of
+# worker threads, each holding its own database connection. Adds and
+# deletes go through worklog.write_queue, so concurrent writes share
+# a transaction.
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import functools
+import json
+import re
+import sys
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+
+from constants import Constants
+import exporter
+import reports
+import validation
+import worklog
+from worklog import Entry
+
+
+SEARCH_PARAMS = ('employee', 'from', 'to', 'minutes', 'lookup', 'pattern')
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 410: 'Gone', 413: 'Payload Too Large',
+               500: 'Internal Server Error'}
+
+
+class ApiError(Exception):
+    '''a request that cannot be served, returned as {"error": message}'''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def entry_json(row):
+    '''an entry row as a json object, dates in the dd/mm/yy hh:mm format'''
+    return {name: exporter.format_date(value) for name, value in row._asdict().items()
+            if name != 'sort_key'}
+
+
+def search_query(params):
+    '''
+    the search query, columns and sort order for the query parameters,
+    the same searches as the find menu
+    '''
+    args = SimpleNamespace(**{name: params.get(name) for name in SEARCH_PARAMS})
+    args.date_from, args.date_to = args.__dict__.pop('from'), args.__dict__.pop('to')
+    try:
+        entries = exporter.search_entries(args)
+    except (ValueError, re.error) as error:
+        raise ApiError(400, str(error).strip())
+    if args.lookup:
+        return (entries, worklog.LIST_FIELDS + (worklog.lookup_snippet('[', ']'),),
+                worklog.EntryIndex.rank(), False)
+    return entries, worklog.LIST_FIELDS, Entry.employee_name, True
+
+
+def int_param(params, name, default, highest=None):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ApiError(400, '{} must be a whole number'.format(name))
+    if value < 1:
+        raise ApiError(400, '{} must be 1 or more'.format(name))
+    return min(value, highest) if highest else value
+
+
+def after_param(params):
+    '''the page cursor, the "next" value of the previous page'''
+    if not params.get('after'):
+        return None
+    try:
+        after = json.loads(params['after'])
+    except ValueError:
+        after = None
+    if not isinstance(after, list) or len(after) != 2:
+        raise ApiError(400, 'after must be the next value of a previous page')
+    return after
+
+
+def find_entries(params):
+    '''one page of a search, with the cursor of the next page'''
+    entries, columns, sort_key, descending = search_query(params)
+    limit = int_param(params, 'limit', Constants.PAGE_SIZE, Constants.API_PAGE_LIMIT)
+    rows, next_after = worklog.entry_page(entries, after_param(params), columns,
+                                          sort_key, descending, limit)
+    return {'entries': [entry_json(row) for row in rows],
+            'next': json.dumps(next_after) if len(rows) == limit else None}
+
+
+def found_entry(entry_id, columns=(Entry.id,)):
+    entry = worklog.find_entry(entry_id, columns)
+    if entry is None:
+        raise ApiError(404, 'No entry {}'.format(entry_id))
+    return entry
+
+
+def get_entry(entry_id):
+    # the notes are shown, so they are read with the rest
+    entry = found_entry(entry_id, Entry._meta.sorted_fields)
+    return {name: exporter.format_date(getattr(entry, name))
+            for name in ('id', 'employee_name', 'completed_task', 'date_started',
+                         'time_string', 'date_completed', 'notes')}
+
+
+def check_entry(body):
+    '''check a posted entry, it has the same keys as an import row'''
+    try:
+        row = json.loads(body or b'null')
+    except ValueError as error:
+        raise ApiError(400, 'Invalid json, {}'.format(error))
+    work_log, reason = validation.check_row(row, datetime.datetime.now())
+    if reason:
+        raise ApiError(400, reason)
+    return work_log
+
+
+def summaries(params):
+    '''a page of the time summaries, see reports.time_report'''
+    period = params.get('period', 'week')
+    if period not in Constants.CALENDAR_PERIODS.values():
+        raise ApiError(400, 'period must be one of {}'.format(
+            ', '.join(Constants.CALENDAR_PERIODS.values())))
+    try:
+        first_day = worklog.parse_day(params['from']) if params.get('from') else None
+        last_day = worklog.parse_day(params['to']) if params.get('to') else None
+    except ValueError as error:
+        raise ApiError(400, str(error).strip())
+
+    limit = int_param(params, 'limit', Constants.API_PAGE_LIMIT, Constants.API_PAGE_LIMIT)
+    page = int_param(params, 'page', 1)
+    report = reports.time_report(period, params.get('employee'), first_day, last_day)
+    rows = report.paginate(page, limit).tuples()
+    return {'period': period, 'page': page,
+            'summaries': [{'Employee Name': name, 'Period Start': start,
+                           'Time Taken': seconds, 'Entries': count}
+                          for name, start, seconds, count in rows]}
+
+
+def changes(params):
+    '''
+    the next batch of the change log, "next" is the after of the batch
+    that follows. 410 when changes after it have been compacted.
+    '''
+    try:
+        after = int(params.get('after') or 0)
+    except ValueError:
+        raise ApiError(400, 'after must be a whole number')
+    limit = int_param(params, 'limit', Constants.CHANGE_BATCH_SIZE,
+                      Constants.CHANGE_BATCH_SIZE)
+    try:
+        batch = worklog.changes_after(after, limit)
+    except ValueError as error:
+        raise ApiError(410, str(error))
+    return {'changes': [{'seq': seq, 'operation': operation, 'entry_id': entry_id,
+                         'changed_at': changed_at.isoformat(), 'entry': entry}
+                        for seq, operation, entry_id, changed_at, entry in batch],
+            'next': batch[-1][0] if batch else after}
+
+
+class WorkLogApi:
+    '''
+    the http server. Each connection is read by asyncio and every
+    query is handed to a pool of at most workers threads, so the event
+    loop never waits on sqlite and no more than workers connections
+    are ever open.
+    '''
+
+    def __init__(self, workers=Constants.API_WORKERS):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='worklog-api')
+        self.routes = [
+            ('GET', re.compile(r'/entries$'), self.find_entries),
+            ('POST', re.compile(r'/entries$'), self.add_entry),
+            ('GET', re.compile(r'/entries/(\d+)$'), self.get_entry),
+            ('DELETE', re.compile(r'/entries/(\d+)$'), self.delete_entry),
+            ('GET', re.compile(r'/summaries$'), self.summaries),
+            ('GET', re.compile(r'/cache$'), self.cache_stats),
+            ('GET', re.compile(r'/changes$'), self.changes),
+        ]
+
+    def run(self, function, *args):
+        '''run a blocking database call on the worker threads'''
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(function, *args))
+
+    async def write(self, submit, value):
+        '''
+        hand a write to the group commit queue and wait for its commit.
+        Queueing runs on a worker thread as it blocks while the queue
+        is full.
+        '''
+        return await asyncio.wrap_future(await self.run(submit, value))
+
+    async def find_entries(self, params, body, writer):
+        if params.get('stream') not in (None, '', '0'):
+            return await self.stream_entries(params, writer)
+        return await self.run(find_entries, params)
+
+    async def stream_entries(self, params, writer):
+        '''
+        write every match as json lines with chunked encoding. The rows
+        are fetched a page at a time, so memory stays flat however many
+        there are and each page may run on a different worker thread.
+        '''
+        entries, columns, sort_key, descending = await self.run(search_query, params)
+        after = after_param(params)
+        write_head(writer, 200, {'Content-Type': 'application/x-ndjson',
+                                 'Transfer-Encoding': 'chunked'})
+        try:
+            while True:
+                rows, after = await self.run(worklog.entry_page, entries, after,
+                                             columns, sort_key, descending,
+                                             Constants.API_STREAM_PAGE)
+                if rows:
+                    chunk = ''.join(json.dumps(entry_json(row)) + '\n'
+                                    for row in rows).encode()
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    await writer.drain()
+                if len(rows) < Constants.API_STREAM_PAGE:
+                    break
+        except Exception as error:
+            # too late for an error response, drop the connection so the
+            # client sees the stream is incomplete
+            raise ConnectionAbortedError(error)
+        writer.write(b'0\r\n\r\n')
+
+    async def add_entry(self, params, body, writer):
+        entry_id = await self.write(worklog.write_queue.add, check_entry(body))
+        return 201, await self.run(get_entry, entry_id)
+
+    async def get_entry(self, params, body, writer, entry_id):
+        return await self.run(get_entry, int(entry_id))
+
+    async def delete_entry(self, params, body, writer, entry_id):
+        await self.run(found_entry, int(entry_id))
+        await self.write(worklog.write_queue.delete, int(entry_id))
+        return {'deleted': int(entry_id)}
+
+    async def summaries(self, params, body, writer):
+        return await self.run(summaries, params)
+
+    async def cache_stats(self, params, body, writer):
+        return worklog.search_cache.stats()
+
+    async def changes(self, params, body, writer):
+        return await self.run(changes, params)
+
+    async def respond(self, method, target, body, writer):
+        '''route one request and write its response'''
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        allowed = []
+        for route_method, path, handler in self.routes:
+            match = path.match(url.path)
+            if not match:
+                continue
+            if route_method != method:
+                allowed.append(route_method)
+                continue
+            result = await handler(params, body, writer, *match.groups())
+            if result is None:
+                return
+            status, payload = result if isinstance(result, tuple) else (200, result)
+            return write_json(writer, status, payload)
+        if allowed:
+            raise ApiError(405, 'Use {}'.format(', '.join(allowed)))
+        raise ApiError(404, 'No such path {}'.format(url.path))
+
+    async def handle_connection(self, reader, writer):
+        '''serve the requests of one keep-alive connection'''
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                try:
+                    await self.respond(method, target, body, writer)
+                except ApiError as error:
+                    write_json(writer, error.status, {'error': str(error)})
+                except Exception as error:
+                    write_json(writer, 500, {'error': repr(error)})
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except ApiError as error:
+            write_json(writer, error.status, {'error': str(error)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=Constants.API_HOST, port=Constants.API_PORT, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port,
+                                            backlog=1024)
+        if ready:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def read_request(reader):
+    '''
+    read one request, returns (method, target, headers, body) or None
+    when the client has closed the connection
+    '''
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError:
+        raise ApiError(400, 'Invalid request line')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ApiError(400, 'Invalid Content-Length')
+    if length > Constants.API_MAX_BODY:
+        raise ApiError(413, 'Request body is larger than {} bytes'
+                       .format(Constants.API_MAX_BODY))
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+def write_head(writer, status, headers):
+    lines = ['HTTP/1.1 {} {}'.format(status, STATUS_TEXT.get(status, ''))]
+    lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+
+def write_json(writer, status, payload):
+    body = json.dumps(payload).encode()
+    write_head(writer, status, {'Content-Type': 'application/json',
+                                'Content-Length': len(body)})
+    writer.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the work log as a json api')
+    parser.add_argument('--host', default=Constants.API_HOST)
+    parser.add_argument('--port', type=int, default=Constants.API_PORT)
+    parser.add_argument('--workers', type=int, default=Constants.API_WORKERS,
+                        help='threads running queries, one connection each')
+    args = parser.parse_args(argv)
+
+    api = WorkLogApi(args.workers)
+
+    def ready(server):
+        print('Serving the work log on http://{}:{}'.format(args.host, args.port),
+              file=sys.stderr)
+    try:
+        asyncio.run(api.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+
+if __name__ == '__main__':
+    main()
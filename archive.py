@@ -0,0 +1,128 @@
+# move closed months out of the main database into yearly archive files
+import argparse
+import datetime
+import sys
+
+from peewee import EXCLUDED, fn
+
+from constants import Constants
+import worklog
+from worklog import ArchivedMonth, Entry, worklog_db
+
+
+def closed_months(keep_months=Constants.ARCHIVE_KEEP_MONTHS, today=None):
+    '''
+    the months still in the main database that ended more than
+    keep_months months ago, oldest first, as 'YYYY-MM'
+    '''
+    today = today or datetime.date.today()
+    month_index = today.year * 12 + today.month - 1 - keep_months
+    cutoff = datetime.datetime(month_index // 12, month_index % 12 + 1, 1)
+    month_started = fn.strftime('%Y-%m', Entry.date_started, 'unixepoch').coerce(False)
+    return [month for month, in (Entry
+                                 .select(month_started)
+                                 .where(Entry.date_started < cutoff)
+                                 .group_by(month_started)
+                                 .order_by(month_started)
+                                 .tuples())]
+
+
+def create_archive(year):
+    '''attach the archive file of a year, creating its tables the first time'''
+    schema = worklog.attach_archive(year)
+    with worklog.partition(schema):
+        worklog_db.create_tables([Entry], safe=True)
+    worklog.create_search_index(schema)
+    return schema
+
+
+def archive_month(month):
+    '''
+    move the entries of a month ('YYYY-MM') to the archive of its year.
+    The copy, the catalogue row and the delete are one transaction; with
+    WAL that is atomic per file, not across both, so the copy ignores
+    rows already archived and an interrupted move is finished by
+    running the archive again. Returns the number of entries moved.
+    '''
+    year = int(month[:4])
+    schema = create_archive(year)
+    start, end = (Entry.date_started.db_value(day)
+                  for day in worklog.period_range('month', month + '-01'))
+    columns = ', '.join('"{}"'.format(field.column_name)
+                        for field in Entry._meta.sorted_fields)
+
+    with worklog_db.atomic():
+        moved, max_id = worklog_db.execute_sql(
+            'SELECT COUNT(*), MAX(id) FROM main.entry '
+            'WHERE date_started BETWEEN ? AND ?', (start, end)).fetchone()
+        if not moved:
+            return 0
+        worklog_db.execute_sql(
+            'INSERT OR IGNORE INTO "{schema}".entry ({columns}) '
+            'SELECT {columns} FROM main.entry WHERE date_started BETWEEN ? AND ?'
+            .format(schema=schema, columns=columns), (start, end))
+        # the archive's triggers only index the notes stored as text
+        copied = worklog_db.execute_sql('SELECT id FROM main.entry '
+                                        'WHERE date_started BETWEEN ? AND ?', (start, end))
+        worklog.index_notes(schema, [entry_id for entry_id, in copied])
+        archived, = worklog_db.execute_sql(
+            'SELECT COUNT(*) FROM "{}".entry WHERE date_started BETWEEN ? AND ?'
+            .format(schema), (start, end)).fetchone()
+        (ArchivedMonth
+         .insert(month=month, path=worklog.archive_path(year),
+                 entry_count=archived, max_id=max_id)
+         .on_conflict(conflict_target=[ArchivedMonth.month],
+                      update={ArchivedMonth.entry_count: EXCLUDED.entry_count,
+                              ArchivedMonth.max_id: fn.MAX(ArchivedMonth.max_id,
+                                                           EXCLUDED.max_id)})
+         .execute())
+        with worklog.changes_unlogged('delete'):
+            worklog_db.execute_sql('DELETE FROM main.entry '
+                                   'WHERE date_started BETWEEN ? AND ?', (start, end))
+    worklog.search_cache.invalidate()
+    return moved
+
+
+def compact():
+    '''give the space of the moved entries back to the file system'''
+    worklog.EntryIndex.optimize()
+    worklog_db.execute_sql('VACUUM main')
+    worklog_db.execute_sql('PRAGMA main.wal_checkpoint(TRUNCATE)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move closed months of entries '
+                                     'into yearly archive files. Searches read '
+                                     'the archives as well as the main database.')
+    parser.add_argument('--keep-months', type=int, default=Constants.ARCHIVE_KEEP_MONTHS,
+                        help='recent months to keep in the main database')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the months that would be archived')
+    parser.add_argument('--no-compact', action='store_true',
+                        help='do not vacuum the main database afterwards')
+    parser.add_argument('--list', action='store_true', help='list the archived months')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for archived in ArchivedMonth.select().order_by(ArchivedMonth.month):
+            print('{} {:>8} entries  {}'.format(archived.month, archived.entry_count,
+                                                archived.path))
+        return 0
+
+    months = closed_months(args.keep_months)
+    if args.dry_run:
+        print('\n'.join(months) or 'Nothing to archive')
+        return 0
+
+    moved = 0
+    for month in months:
+        count = archive_month(month)
+        moved += count
+        print('{} {} entries archived'.format(month, count), file=sys.stderr)
+    if moved and not args.no_compact:
+        compact()
+    print('{} entries archived from {} months'.format(moved, len(months)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
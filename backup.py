@@ -0,0 +1,346 @@
+# online backups of the work log, taken while it is in use
+#
+#   python backup.py                     take a snapshot
+#   python backup.py --list
+#   python backup.py --verify
+#   python backup.py --restore 20171201T093000Z
+#
+# A snapshot copies the main database and every archive file with
+# SQLite's online backup API, a few pages per step with a pause between
+# steps so writers carry on. Each copy is checked, gzipped and its
+# sha256 written to a json manifest named after the snapshot. Older
+# snapshots are pruned after each backup: the newest BACKUP_KEEP_LAST
+# are kept, and the newest of each of the last BACKUP_KEEP_DAILY days.
+import argparse
+from contextlib import nullcontext
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from urllib.parse import quote
+
+from constants import Constants
+import worklog
+from worklog import ArchivedMonth, worklog_db
+
+
+CHUNK_BYTES = 1024 * 1024
+
+
+class BackupRestarted(Exception):
+    '''the source kept changing under an incremental copy'''
+
+
+def busy_timeout():
+    '''seconds to wait for a lock, the same as the work log's own connections'''
+    return float(worklog.database_profile()['busy_timeout']) / 1000
+
+
+def backup_dir():
+    '''snapshots sit next to the main database, in <name>_backups'''
+    return '{}_backups'.format(os.path.splitext(worklog_db.database)[0])
+
+
+def database_files():
+    '''
+    the main database then each archive file, as paths. The archives
+    are found next to the main database, where attach_archive opens
+    them, not at the path they were first written to.
+    '''
+    months = ArchivedMonth.select(ArchivedMonth.month).tuples()
+    archives = [worklog.archive_path(year)
+                for year in sorted({month[:4] for month, in months})]
+    return [worklog_db.database] + [path for path in archives if os.path.exists(path)]
+
+
+def snapshot_id(directory):
+    '''a new snapshot's name, the UTC time it was taken so names sort by age'''
+    name = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    taken = name
+    suffix = 0
+    while os.path.exists(manifest_path(directory, taken)):
+        suffix += 1
+        taken = '{}-{}'.format(name, suffix)
+    return taken
+
+
+def manifest_path(directory, snapshot):
+    return os.path.join(directory, snapshot + '.json')
+
+
+def copy_database(path, target, pages=Constants.BACKUP_PAGES,
+                  sleep_ms=Constants.BACKUP_SLEEP_MS):
+    '''
+    copy a database file to target with the online backup API, pages at
+    a time, sleeping sleep_ms between steps. The source is only read
+    during a step, so writers are not held up by the copy. A write by
+    another connection restarts the copy; after BACKUP_RESTARTS restarts
+    the rest is copied in one step, which under WAL still only reads.
+    Returns the user_version and page count of the copy.
+    '''
+    uri = 'file:{}?mode=ro'.format(quote(os.path.abspath(path)))
+    source = sqlite3.connect(uri, uri=True, timeout=busy_timeout())
+    copy = sqlite3.connect(target)
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > Constants.BACKUP_RESTARTS:
+                raise BackupRestarted(path)
+        last_remaining = remaining
+        time.sleep(sleep_ms / 1000)
+
+    try:
+        try:
+            source.backup(copy, pages=pages, progress=progress)
+        except BackupRestarted:
+            source.backup(copy)
+        check, = copy.execute('PRAGMA quick_check').fetchone()
+        if check != 'ok':
+            raise sqlite3.DatabaseError('{} copied badly, {}'.format(path, check))
+        version, = copy.execute('PRAGMA user_version').fetchone()
+        page_count, = copy.execute('PRAGMA page_count').fetchone()
+        return version, page_count
+    finally:
+        copy.close()
+        source.close()
+
+
+def compress_file(path, target):
+    '''gzip path to target, returns the sha256 and size of the uncompressed file'''
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as original, gzip.open(target + '.tmp', 'wb',
+                                                 Constants.BACKUP_COMPRESS_LEVEL) as packed:
+        for chunk in iter(lambda: original.read(CHUNK_BYTES), b''):
+            digest.update(chunk)
+            size += len(chunk)
+            packed.write(chunk)
+    os.replace(target + '.tmp', target)
+    return digest.hexdigest(), size
+
+
+def take_snapshot(directory=None, pages=Constants.BACKUP_PAGES,
+                  sleep_ms=Constants.BACKUP_SLEEP_MS):
+    '''
+    back up the main database and its archives without stopping the
+    work log. The manifest is written last, so a snapshot without one
+    was interrupted and is never listed or restored. Returns its name.
+    '''
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    snapshot = snapshot_id(directory)
+    manifest = {'snapshot': snapshot,
+                'taken': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'files': []}
+    for path in database_files():
+        name = os.path.basename(path)
+        copied = os.path.join(directory, '{}_{}'.format(snapshot, name))
+        try:
+            version, page_count = copy_database(path, copied, pages, sleep_ms)
+            sha256, size = compress_file(copied, copied + '.gz')
+        finally:
+            if os.path.exists(copied):
+                os.remove(copied)
+        manifest['files'].append({'name': name, 'snapshot': os.path.basename(copied) + '.gz',
+                                  'sha256': sha256, 'bytes': size, 'pages': page_count,
+                                  'user_version': version})
+    with open(manifest_path(directory, snapshot) + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path(directory, snapshot) + '.tmp', manifest_path(directory, snapshot))
+    return snapshot
+
+
+def snapshots(directory=None):
+    '''the manifests of the finished snapshots, oldest first'''
+    manifests = []
+    for path in sorted(glob.glob(manifest_path(directory or backup_dir(), '*'))):
+        with open(path) as manifest_file:
+            manifests.append(json.load(manifest_file))
+    return manifests
+
+
+def read_manifest(snapshot, directory=None):
+    path = manifest_path(directory or backup_dir(), snapshot)
+    if not os.path.exists(path):
+        raise ValueError('No snapshot {}'.format(snapshot))
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def unpack_file(directory, entry, target=None):
+    '''
+    gunzip one file of a snapshot, to target when given. Raises
+    ValueError if it does not match the checksum taken when it was
+    backed up.
+    '''
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with gzip.open(os.path.join(directory, entry['snapshot']), 'rb') as packed, \
+                (open(target, 'wb') if target else nullcontext()) as original:
+            for chunk in iter(lambda: packed.read(CHUNK_BYTES), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                if original:
+                    original.write(chunk)
+    except (OSError, EOFError) as error:
+        raise ValueError('{} cannot be read, {}'.format(entry['snapshot'], error))
+    if digest.hexdigest() != entry['sha256'] or size != entry['bytes']:
+        raise ValueError('{} does not match its checksum'.format(entry['snapshot']))
+
+
+def verify_snapshot(snapshot, directory=None):
+    '''check every file of a snapshot against its checksum, raises ValueError if one fails'''
+    directory = directory or backup_dir()
+    for entry in read_manifest(snapshot, directory)['files']:
+        unpack_file(directory, entry)
+
+
+def restore_snapshot(snapshot, directory=None, target_dir=None):
+    '''
+    put the files of a snapshot back, by default next to the main
+    database. Every file is unpacked and checked before any is written.
+    Each is then copied into place with the backup API, which waits for
+    the writers and updates the open database rather than replacing the
+    file under them. Returns the paths restored.
+    '''
+    directory = directory or backup_dir()
+    target_dir = target_dir or os.path.dirname(os.path.abspath(worklog_db.database))
+    manifest = read_manifest(snapshot, directory)
+    os.makedirs(target_dir, exist_ok=True)
+    newest = max(entry['user_version'] for entry in manifest['files'])
+    if newest > worklog.SCHEMA_VERSION:
+        raise ValueError('{} was taken by a newer version of the work log (schema {})'
+                         .format(snapshot, newest))
+
+    unpacked = []
+    try:
+        for entry in manifest['files']:
+            path = os.path.join(directory, '{}.restore'.format(entry['snapshot'][:-3]))
+            unpacked.append(path)
+            unpack_file(directory, entry, path)
+
+        restored = []
+        for entry, path in zip(manifest['files'], unpacked):
+            target = os.path.join(target_dir, entry['name'])
+            source = sqlite3.connect(path)
+            destination = sqlite3.connect(target, timeout=busy_timeout())
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+                source.close()
+            restored.append(target)
+    finally:
+        for path in unpacked:
+            if os.path.exists(path):
+                os.remove(path)
+    worklog.search_cache.invalidate()
+    return restored
+
+
+def retained(names, keep_last=Constants.BACKUP_KEEP_LAST,
+             keep_daily=Constants.BACKUP_KEEP_DAILY):
+    '''
+    the snapshots kept by a prune - the newest keep_last, and the newest
+    of each of the last keep_daily days a snapshot was taken on
+    '''
+    newest_first = sorted(names, reverse=True)
+    keep = set(newest_first[:keep_last])
+    days = {}
+    for name in newest_first:
+        days.setdefault(name[:8], name)
+    keep.update(list(days.values())[:keep_daily])
+    return keep
+
+
+def prune_snapshots(directory=None, keep_last=Constants.BACKUP_KEEP_LAST,
+                    keep_daily=Constants.BACKUP_KEEP_DAILY):
+    '''delete the snapshots the retention policy does not keep, returns their names'''
+    directory = directory or backup_dir()
+    manifests = snapshots(directory)
+    keep = retained([manifest['snapshot'] for manifest in manifests], keep_last, keep_daily)
+    pruned = []
+    for manifest in manifests:
+        if manifest['snapshot'] in keep:
+            continue
+        # the manifest goes first, so a prune that stops half way leaves
+        # files that are never listed rather than a snapshot with holes
+        os.remove(manifest_path(directory, manifest['snapshot']))
+        for entry in manifest['files']:
+            path = os.path.join(directory, entry['snapshot'])
+            if os.path.exists(path):
+                os.remove(path)
+        pruned.append(manifest['snapshot'])
+    return pruned
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Back up the work log while it is '
+                                     'in use, or restore a backup')
+    parser.add_argument('--dir', help='snapshot directory, by default {}'
+                        .format(os.path.basename(backup_dir())))
+    parser.add_argument('--list', action='store_true', help='list the snapshots')
+    parser.add_argument('--verify', nargs='?', const='', metavar='SNAPSHOT',
+                        help='check the checksums of a snapshot, by default all')
+    parser.add_argument('--restore', metavar='SNAPSHOT',
+                        help='put the database and archives of a snapshot back')
+    parser.add_argument('--pages', type=int, default=Constants.BACKUP_PAGES,
+                        help='pages copied per step')
+    parser.add_argument('--sleep-ms', type=int, default=Constants.BACKUP_SLEEP_MS,
+                        help='pause between steps')
+    parser.add_argument('--keep-last', type=int, default=Constants.BACKUP_KEEP_LAST)
+    parser.add_argument('--keep-daily', type=int, default=Constants.BACKUP_KEEP_DAILY)
+    parser.add_argument('--no-prune', action='store_true',
+                        help='keep every snapshot after this backup')
+    args = parser.parse_args(argv)
+    directory = args.dir or backup_dir()
+
+    if args.list:
+        for manifest in snapshots(directory):
+            size = sum(os.path.getsize(os.path.join(directory, entry['snapshot']))
+                       for entry in manifest['files']
+                       if os.path.exists(os.path.join(directory, entry['snapshot'])))
+            print('{:<20} {:>3} files {:>10} bytes'.format(
+                manifest['snapshot'], len(manifest['files']), size))
+        return 0
+
+    if args.verify is not None:
+        names = ([args.verify] if args.verify else
+                 [manifest['snapshot'] for manifest in snapshots(directory)])
+        failed = 0
+        for name in names:
+            try:
+                verify_snapshot(name, directory)
+                print('{} ok'.format(name))
+            except ValueError as error:
+                failed += 1
+                print('{} failed, {}'.format(name, error))
+        return 1 if failed else 0
+
+    if args.restore:
+        try:
+            restored = restore_snapshot(args.restore, directory)
+        except ValueError as error:
+            parser.error(str(error))
+        print('Restored {}'.format(', '.join(restored)))
+        return 0
+
+    snapshot = take_snapshot(directory, args.pages, args.sleep_ms)
+    print('Snapshot {} written to {}'.format(snapshot, directory))
+    if not args.no_prune:
+        for name in prune_snapshots(directory, args.keep_last, args.keep_daily):
+            print('{} pruned'.format(name), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# synthetic timesheets and benchmarks for the search, add and delete paths
+import argparse
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from peewee import fn
+
+from constants import Constants
+import worklog
+from worklog import Employee, Entry
+
+
+FIRST_NAMES = ['Stuart', 'Milka', 'Gordon', 'Ann', 'Ravi', 'Chen', 'Maria',
+               'Olu', 'Sven', 'Aiko', 'Fatima', 'Liam', 'Noor', 'Pablo']
+LAST_NAMES = ['McIntosh', 'Graham', 'Lee', 'Patel', 'Wang', 'Garcia', 'Okafor',
+              'Larsen', 'Sato', 'Khan', 'Murphy', 'Haddad', 'Silva', 'Novak']
+TASK_WORDS = ['database', 'cleanup', 'review', 'deploy', 'walked', 'dog',
+              'meeting', 'report', 'invoice', 'backup', 'migration', 'support',
+              'testing', 'design', 'planning', 'training', 'customer', 'fix']
+NOTE_WORDS = TASK_WORDS + ['the', 'a', 'with', 'and', 'for', 'after', 'before',
+                           'server', 'schema', 'index', 'query', 'call', 'team',
+                           'notes', 'issue', 'ticket', 'release', 'weekly']
+
+
+def generate_worklogs(count, seed=1, employees=200, days=3 * 365,
+                      end=datetime.datetime(2017, 5, 1)):
+    '''
+    yield count realistic work logs, in the same form add_entry builds.
+    The same seed always gives the same data. A few employees log most
+    of the entries (a zipf like skew), most tasks take under an hour
+    but some run for days, and notes vary from empty to a few thousand
+    characters.
+    '''
+    # the staff list does not depend on the seed, so data generated in
+    # several runs shares one set of employees
+    staff = random.Random(employees)
+    names = ['{} {}{}'.format(staff.choice(FIRST_NAMES), staff.choice(LAST_NAMES),
+                              number or '')
+             for number in range(employees)]
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, employees + 1)]
+    start = end - datetime.timedelta(days=days)
+
+    for _ in range(count):
+        date_started = start + datetime.timedelta(
+            minutes=rng.randrange(days * 24 * 60))
+        minutes = max(1, min(int(rng.lognormvariate(3.5, 1.1)), 5 * 24 * 60))
+        date_completed = date_started + datetime.timedelta(minutes=minutes)
+        time_taken, time_str = worklog.total_time(date_started, date_completed)
+        task = ' '.join(rng.choice(TASK_WORDS) for _ in range(rng.randint(1, 3)))
+        note_words = int(rng.paretovariate(1.2) * 5) if rng.random() > 0.1 else 0
+        notes = ' '.join(rng.choice(NOTE_WORDS) for _ in range(min(note_words, 600)))
+        yield {
+            'Employee Name': rng.choices(names, weights)[0],
+            'Task Completed': task[:30],
+            'Date Started': date_started,
+            'Date Completed': date_completed,
+            'Time Taken': time_taken,
+            'Time String': time_str,
+            'Notes': notes,
+        }
+
+
+def populate(count, seed=1, chunk_size=Constants.IMPORT_CHUNK_SIZE, progress=None):
+    '''save count generated work logs, chunk_size per transaction'''
+    chunk = []
+    saved = 0
+    for work_log in generate_worklogs(count, seed):
+        chunk.append(work_log)
+        if len(chunk) >= chunk_size:
+            worklog.save_entries(chunk)
+            saved += len(chunk)
+            chunk = []
+            if progress:
+                progress(saved)
+    if chunk:
+        worklog.save_entries(chunk)
+        saved += len(chunk)
+    if progress:
+        progress(saved)
+
+
+def run_search(entries, **page_options):
+    '''what display_worklogs does for a search: a count and the first page'''
+    worklog.entry_count(entries)
+    worklog.entry_page(entries, **page_options)
+
+
+def benchmarks(rng):
+    '''
+    the benchmarks as name: function pairs, each function runs one
+    operation with random arguments drawn from rng
+    '''
+    employee_ids = [id for id, in Employee.select(Employee.id).tuples()]
+    first = Entry.select(fn.MIN(Entry.date_started)).scalar()
+    last = Entry.select(fn.MAX(Entry.date_started)).scalar()
+    if first is None:
+        raise ValueError('no entries to benchmark, populate the database first')
+    span = max(int((last - first).total_seconds()), 1)
+
+    def find_by_employee():
+        run_search(worklog.entries_by_employee(rng.choice(employee_ids)))
+
+    def find_by_date():
+        start = first + datetime.timedelta(seconds=rng.randrange(span))
+        run_search(worklog.entries_by_date(start, start + datetime.timedelta(days=7)))
+
+    def find_by_duration():
+        first_minute = rng.randrange(1, 240)
+        run_search(worklog.entries_by_duration(first_minute, first_minute + 15))
+
+    def find_by_lookup():
+        run_search(worklog.entries_by_lookup(rng.choice(TASK_WORDS)),
+                   columns=worklog.LIST_FIELDS + (worklog.lookup_snippet(),),
+                   sort_key=worklog.EntryIndex.rank(), descending=False)
+
+    def find_by_pattern():
+        run_search(worklog.entries_by_pattern(r'{}\s+\w+'.format(rng.choice(TASK_WORDS))))
+
+    def calendar_summary():
+        worklog.calendar_buckets(rng.choice(list(Constants.CALENDAR_PERIODS.values())))
+
+    new_entries = generate_worklogs(10 ** 9, seed=rng.randrange(10 ** 6))
+    added = []
+
+    def create_entry():
+        work_log = next(new_entries)
+        worklog.save_entries([work_log])
+        added.append(Entry.select(fn.MAX(Entry.id)).scalar())
+
+    def create_entries_100():
+        worklog.save_entries([next(new_entries) for _ in range(100)])
+
+    def delete_entry():
+        if added:
+            worklog.delete_entries([added.pop()])
+
+    return [
+        ('find_by_employee', find_by_employee),
+        ('find_by_date', find_by_date),
+        ('find_by_duration', find_by_duration),
+        ('find_by_lookup', find_by_lookup),
+        ('find_by_pattern', find_by_pattern),
+        ('calendar_summary', calendar_summary),
+        ('create_entry', create_entry),
+        ('create_entries_100', create_entries_100),
+        ('delete_entry', delete_entry),
+    ]
+
+
+def percentile(timings, percent):
+    '''the percent-th percentile of the timings'''
+    if len(timings) == 1:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1]
+
+
+def run_benchmarks(repeat=20, seed=1, only=None):
+    '''
+    time every benchmark repeat times. Returns name: results where the
+    results are latency percentiles in milliseconds and the peak memory
+    allocated in kilobytes.
+    '''
+    rng = random.Random(seed)
+    results = {}
+    for name, benchmark in benchmarks(rng):
+        if only and name not in only:
+            continue
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            benchmark()
+            timings.append((time.perf_counter() - start) * 1000)
+        # tracing slows python down, so memory is measured on a separate run
+        tracemalloc.start()
+        benchmark()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(max(timings), 3),
+            'peak_kb': round(peak / 1024, 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+    the benchmarks whose median latency or peak memory grew by more
+    than tolerance over the baseline, as (name, measure, old, new)
+    '''
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        for measure in ('p50_ms', 'peak_kb'):
+            # ignore noise on anything that is tiny to begin with
+            if result[measure] > old[measure] * (1 + tolerance) and \
+                    result[measure] - old[measure] > 1:
+                regressions.append((name, measure, old[measure], result[measure]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the work log '
+                                     'against generated timesheets')
+    parser.add_argument('--db', default='worklog_bench.db',
+                        help='database to benchmark, filled if it has fewer rows')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='number of entries to generate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='times each benchmark is run')
+    parser.add_argument('--only', nargs='*', help='benchmarks to run')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slow down over the baseline, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    worklog.worklog_db.init(args.db, pragmas=worklog.database_profile())
+
+    existing = Entry.select().count()
+    if existing < args.rows:
+        def progress(saved):
+            print('\r{} entries generated'.format(existing + saved),
+                  end='', file=sys.stderr)
+        populate(args.rows - existing, args.seed + existing, progress=progress)
+        print(file=sys.stderr)
+    if not existing and args.rows < 1:
+        print('{} has no entries, run with --rows to populate it first'.format(args.db),
+              file=sys.stderr)
+        return 1
+
+    results = run_benchmarks(args.repeat, args.seed, args.only)
+    print('{:<20} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'peak kb'))
+    for name, result in results.items():
+        print('{:<20} {p50_ms:>10} {p95_ms:>10} {p99_ms:>10} {max_ms:>10} '
+              '{peak_kb:>10}'.format(name, **result))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump({'rows': args.rows, 'results': results}, baseline_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, measure, old, new in regressions:
+            print('REGRESSION {} {} {} -> {}'.format(name, measure, old, new))
+        if regressions:
+            return 1
+        print('No regressions against {}'.format(args.compare))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# non-interactive command line for scripts and batch jobs
+#
+#   python cli.py add --employee "Stuart McIntosh" --task "Completed database" \
+#       --started "01/05/17 09:15" --completed "01/05/17 10:00" --notes "..."
+#   python cli.py search --employee "Stuart McIntosh"
+#   python cli.py search --from 01/05/17 --to 31/05/17 --format csv
+#   python cli.py delete 12 13
+#   python cli.py report --period month
+#   python cli.py changes --after 1200
+#
+# Every command runs once and prints json lines (or csv) to stdout.
+# Only the modules a command needs are imported, so start up stays fast.
+import argparse
+import json
+import os
+import sys
+
+from constants import Constants
+
+
+def open_database():
+    '''import the work log, its database opens on the first query'''
+    import worklog
+    return worklog
+
+
+def print_json(value):
+    print(json.dumps(value, default=str))
+
+
+def add(args):
+    '''add an entry, checked with the same rules as the prompts'''
+    import datetime
+    import exporter
+    import validation
+
+    worklog = open_database()
+    work_log, reason = validation.check_row(
+        {'Employee Name': args.employee, 'Task Completed': args.task,
+         'Date Started': args.started, 'Date Completed': args.completed,
+         'Notes': args.notes}, datetime.datetime.now())
+    if reason:
+        return fail(reason)
+    entry_id, = worklog.save_entries([work_log])
+    # dates as search and export print them
+    print_json({key: exporter.format_date(value)
+                for key, value in dict(work_log, Id=entry_id).items()})
+    return 0
+
+
+def search(args):
+    '''print the entries matching a search, or write them to a file'''
+    import re
+    import exporter
+
+    open_database()
+    try:
+        entries = exporter.search_entries(args)
+    except (ValueError, re.error) as error:
+        return fail(error)
+    if getattr(args, 'limit', 0):
+        entries = entries.limit(args.limit)
+
+    output = getattr(args, 'output', '-')
+    if output == '-':
+        try:
+            exporter.export_entries(entries, sys.stdout, args.format)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # the reader went away early, i.e. piped into head
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    else:
+        with open(output, 'w', newline='', encoding='utf-8') as export_file:
+            count = exporter.export_entries(entries, export_file, args.format)
+        print_json({'exported': count, 'output': output})
+    return 0
+
+
+def delete(args):
+    '''delete entries by id'''
+    worklog = open_database()
+    found = [entry_id for entry_id in dict.fromkeys(args.ids)
+             if worklog.find_entry(entry_id, (worklog.Entry.id,))]
+    worklog.delete_entries(found)
+    print_json({'deleted': found,
+                'not_found': sorted(set(args.ids) - set(found))})
+    return 0 if len(found) == len(set(args.ids)) else 1
+
+
+def report(args):
+    '''print the time summaries'''
+    import reports
+
+    worklog = open_database()
+    try:
+        first_day = worklog.parse_day(args.date_from) if args.date_from else None
+        last_day = worklog.parse_day(args.date_to) if args.date_to else None
+    except ValueError as error:
+        return fail(error)
+
+    time_report = reports.time_report(args.period, args.employee, first_day, last_day)
+    if args.format == 'csv':
+        reports.print_report(time_report, args.period, file_format='csv')
+    else:
+        for name, start, seconds, count in time_report.tuples().iterator():
+            print_json({'Employee Name': name, 'Period': args.period,
+                        'Period Start': start, 'Time Taken': seconds,
+                        'Entries': count})
+    return 0
+
+
+def import_file(args):
+    '''bulk import a csv or jsonl file'''
+    import importer
+
+    open_database()
+    imported, rejected = importer.import_file(args.path, args.format)
+    for line_num, row, reason in rejected:
+        print_json({'line': line_num, 'reason': reason})
+    print_json({'imported': imported, 'rejected': len(rejected)})
+    return 1 if rejected else 0
+
+
+def changes(args):
+    '''print the change log after a seq, or compact it'''
+    worklog = open_database()
+    if args.compact:
+        print_json({'compacted': worklog.compact_changes(args.keep_days)})
+        return 0
+    try:
+        batch = worklog.changes_after(args.after, args.limit)
+    except ValueError as error:
+        return fail(error)
+    for seq, operation, entry_id, changed_at, entry in batch:
+        print_json({'seq': seq, 'operation': operation, 'entry_id': entry_id,
+                    'changed_at': changed_at.isoformat(), 'entry': entry})
+    return 0
+
+
+def fail(error):
+    '''report a value that did not pass its check'''
+    print_json({'error': str(error).strip()})
+    return 2
+
+
+def add_search_arguments(parser):
+    '''the search options, shared with the other command line tools'''
+    search = parser.add_argument_group('search, by default every entry')
+    search.add_argument('--employee', help='full name of the employee')
+    search.add_argument('--from', dest='date_from', metavar='DD/MM/YY',
+                        help='first start date to include')
+    search.add_argument('--to', dest='date_to', metavar='DD/MM/YY',
+                        help='last start date to include')
+    search.add_argument('--minutes', help='time taken, i.e. 100 or 100-300')
+    search.add_argument('--lookup', help='full text search of task and notes')
+    search.add_argument('--pattern', help='regular expression over task, '
+                                          'notes and employee name')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Work log commands')
+    parser.add_argument('--db', help='database file, by default worklog.db '
+                                     'or WORKLOG_DB')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('add', help='add a timesheet entry')
+    command.add_argument('--employee', required=True, help='firstname lastname')
+    command.add_argument('--task', required=True, help='up to 30 characters')
+    command.add_argument('--started', required=True, metavar='"DD/MM/YY HH:MM"')
+    command.add_argument('--completed', required=True, metavar='"DD/MM/YY HH:MM"')
+    command.add_argument('--notes', default='')
+    command.set_defaults(handler=add)
+
+    command = commands.add_parser('search', help='print matching entries')
+    add_search_arguments(command)
+    command.add_argument('--limit', type=int, default=0,
+                         help='most entries to print, by default all')
+    command.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    command.set_defaults(handler=search)
+
+    command = commands.add_parser('delete', help='delete entries by id')
+    command.add_argument('ids', type=int, nargs='+')
+    command.set_defaults(handler=delete)
+
+    command = commands.add_parser('export', help='export matching entries')
+    add_search_arguments(command)
+    command.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    command.add_argument('-o', '--output', default='-',
+                         help='file to write, by default stdout')
+    command.set_defaults(handler=search)
+
+    command = commands.add_parser('report', help='time per employee per period')
+    command.add_argument('--period', choices=['day', 'week', 'month'], default='week')
+    command.add_argument('--employee', help='full name of the employee')
+    command.add_argument('--from', dest='date_from', metavar='DD/MM/YY')
+    command.add_argument('--to', dest='date_to', metavar='DD/MM/YY')
+    command.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    command.set_defaults(handler=report)
+
+    command = commands.add_parser('import', help='bulk import a csv or jsonl file')
+    command.add_argument('path')
+    command.add_argument('--format', choices=['csv', 'jsonl'])
+    command.set_defaults(handler=import_file)
+
+    command = commands.add_parser('changes', help='changes to entries after a seq')
+    command.add_argument('--after', type=int, default=0,
+                         help='seq of the last change already read')
+    command.add_argument('--limit', type=int, default=Constants.CHANGE_BATCH_SIZE,
+                         help='most changes to print')
+    command.add_argument('--compact', action='store_true',
+                         help='delete the changes older than --keep-days')
+    command.add_argument('--keep-days', type=int, default=Constants.CHANGE_KEEP_DAYS)
+    command.set_defaults(handler=changes)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.db:
+        # read when the work log is imported
+        os.environ['WORKLOG_DB'] = args.db
+    return args.handler(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,3 @@
-import datetime
 import re
 
 
@@ -25,21 +24,153 @@ class Constants:
     6. Return to main menu
     '''
 
+    DATE_SEARCH_MENU = '''
+    Find Timesheets by Date
+
+    1. Search a range of dates
+    2. Calendar summary by day, week or month
+    '''
+
+    CALENDAR_PERIODS = {'d': 'day', 'w': 'week', 'm': 'month'}
+
+    # number of compiled regular expressions kept for pattern searches
+    PATTERN_CACHE_SIZE = 128
+
+    # SQLite connection profiles, pick one per deployment with the
+    # WORKLOG_DB_PROFILE environment variable. WAL lets readers carry on
+    # while someone saves, busy_timeout (ms) waits for a lock instead of
+    # failing straight away. Use 'rollback' where WAL is not supported,
+    # i.e. a database on a network share.
+    DB_PROFILES = {
+        'default': {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'memory',
+            'busy_timeout': 5000,
+        },
+        'durable': {
+            'journal_mode': 'wal',
+            'synchronous': 'full',
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'memory',
+            'busy_timeout': 10000,
+        },
+        'rollback': {
+            'journal_mode': 'delete',
+            'synchronous': 'full',
+            'cache_size': -16000,
+            'mmap_size': 0,
+            'temp_store': 'memory',
+            'busy_timeout': 10000,
+        },
+    }
+
+    # writes that still find the database locked are retried this many
+    # times, waiting DB_RETRY_DELAY seconds doubled each time
+    DB_WRITE_RETRIES = 5
+    DB_RETRY_DELAY = 0.05
+
+    # instrumentation, switched on with WORKLOG_INSTRUMENT=1. Statements
+    # slower than SLOW_QUERY_MS are logged with their query plan
+    SLOW_QUERY_MS = 100
+    SLOW_QUERY_LOG = 'worklog_slow_queries.log'
+    STATS_FILE = 'worklog_stats.json'
+
+    # number of entries listed per page of search results
+    PAGE_SIZE = 10
+
+    # most search results (pages and counts) kept in memory, any write
+    # empties the cache
+    SEARCH_CACHE_SIZE = 256
+
+    # json api - address, worker threads (each holds one database
+    # connection), most entries per page, rows fetched per streamed
+    # chunk and the largest request body accepted
+    API_HOST = '127.0.0.1'
+    API_PORT = 8080
+    API_WORKERS = 8
+    API_PAGE_LIMIT = 100
+    API_STREAM_PAGE = 500
+    API_MAX_BODY = 64 * 1024
+
+    # group commit - most writes waiting in the queue before writers
+    # block, most writes per transaction and the longest a write waits
+    # in milliseconds for others to join its transaction
+    WRITE_QUEUE_SIZE = 1000
+    WRITE_BATCH_SIZE = 200
+    WRITE_BATCH_MS = 5
+
+    # months of entries kept in the main database by archive.py, older
+    # months are moved to yearly archive files
+    ARCHIVE_KEEP_MONTHS = 3
+    # archives attached to one connection at a time. SQLite allows 10
+    # attached files, so the archive used longest ago is detached to
+    # make room for another
+    ARCHIVES_ATTACHED = 8
+
+    # reports aggregated from the entries rather than the summaries are
+    # split into a chunk per month of each database file and run on this
+    # many worker processes
+    REPORT_WORKERS = 4
+    # width of the bands of a duration histogram
+    HISTOGRAM_MINUTES = 15
+
+    # analytics.py - percentiles shown by default, and how many
+    # interquartile ranges past the upper quartile make an outlier
+    ANALYTICS_PERCENTILES = (50, 90, 95, 99)
+    OUTLIER_IQRS = 3
+
+    # change log - most changes returned per batch and the days they are
+    # kept for by compaction
+    CHANGE_BATCH_SIZE = 1000
+    CHANGE_KEEP_DAYS = 30
+
+    # notes longer than this many bytes are stored zlib compressed at
+    # this level, None stores every note as text. Existing notes are
+    # compressed this many entries per transaction by
+    # python worklog.py --compress-notes
+    NOTES_COMPRESS_BYTES = 512
+    NOTES_COMPRESS_LEVEL = 6
+    NOTES_COMPRESS_BATCH = 500
+
+    # backup.py - pages copied per step of an online backup and the pause
+    # between steps in milliseconds, restarts allowed before the rest is
+    # copied in one step, the gzip level of the snapshot files, and the
+    # snapshots kept - the newest BACKUP_KEEP_LAST plus the newest of
+    # each of the last BACKUP_KEEP_DAILY days
+    BACKUP_PAGES = 256
+    BACKUP_SLEEP_MS = 10
+    BACKUP_RESTARTS = 3
+    BACKUP_COMPRESS_LEVEL = 6
+    BACKUP_KEEP_LAST = 7
+    BACKUP_KEEP_DAILY = 14
+
+    # bulk import - rows saved per transaction and the columns each row needs
+    IMPORT_CHUNK_SIZE = 1000
+    IMPORT_COLUMNS = ('Employee Name', 'Task Completed',
+                      'Date Started', 'Date Completed')
+
+    # the checks on the values of an entry, see validation.py. The start
+    # and completed dates are compared with the time each batch is checked
     INPUT_CHECK = {
         'EMP_C': {'match' : r'[\w]+\s[\w]+'},
-        'EMP_MSG' : '\nPlease enter you name in the format firstname lastname ',
+        'EMP_MSG' : '\nPlease enter your name in the format firstname lastname ',
         'GT_C' : {'>=' : 1},
         'GT_MSG' : '\nPlease enter task completed cannot be more than 30 characters',
         'LT_C' : {'=<' : 30},
         'LT_MSG' : '\nEntry must not be greater than 30 characters ',
         'GLT_C': {'>=' : 1, '=<' : 30},
-        'GLT_MSG' : '\nEnter task, task must not blank or greater than 30 characters ',
+        'GLT_MSG' : '\nEnter task, task must not be blank or greater than 30 characters ',
         'DATE_C' : {'date' : '%d/%m/%y %H:%M'},
         'DATE_MSG' : '\nPlease enter the date and time in the format dd/mm/yy 12:00 ',
-        'DATE_S_C' : {'date': '%d/%m/%y %H:%M', 'date started' : datetime.datetime.now()},
-        'DATE_S_MSG' : '\nPlease enter the date and time started in the format dd/mm/yy 12:00 ',
-        'DATE_C_C' : {'date': '%d/%m/%y %H:%M', 'date completed' : datetime.datetime.now()},
-        'DATE__C_MSG' : '\nPlease enter the date and time started in the format dd/mm/yy 12:00 '
+        'DATE_S_C' : {'date': '%d/%m/%y %H:%M', 'date started' : 'before now'},
+        'DATE_S_MSG' : '\nThe start date cannot be in the future! ',
+        'DATE_C_C' : {'date': '%d/%m/%y %H:%M', 'date completed' : 'after started, before now'},
+        'DATE_C_MSG' : '\nThe completed date cannot be before the start date or '
+                       'after the current date and time! '
     }
 
 
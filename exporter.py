@@ -0,0 +1,117 @@
+# streaming export of timesheets to csv / jsonl files
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+
+from peewee import SQL
+
+from cli import add_search_arguments
+import worklog
+from worklog import Employee, Entry
+
+
+# same column names as the importer so an export can be imported again,
+# the importer ignores the id
+EXPORT_COLUMNS = [
+    ('Id', Entry.id),
+    ('Employee Name', Entry.employee_name),
+    ('Task Completed', Entry.completed_task),
+    ('Date Started', Entry.date_started),
+    ('Date Completed', Entry.date_completed),
+    ('Time Taken', Entry.time_taken),
+    ('Time String', worklog.TIME_STRING),
+    ('Notes', Entry.notes),
+]
+
+
+def format_date(value):
+    '''write dates in the dd/mm/yy hh:mm format the prompts and importer use'''
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d/%m/%y %H:%M')
+    return value
+
+
+def export_rows(entries):
+    '''
+    yield each entry of a search as a tuple of the export columns, the
+    main database first and then each archive, at most the search's
+    limit of them in all. The query is read with a cursor iterator and
+    never cached, so memory stays flat however many rows there are.
+    '''
+    fields = [field.alias(name) for name, field in EXPORT_COLUMNS]
+    for row in worklog.partition_rows(entries.select(*fields),
+                                      worklog.search_partitions(entries),
+                                      limit=entries._limit):
+        yield tuple(format_date(value) for value in row)
+
+
+def export_entries(entries, output, file_format='csv'):
+    '''write the entries of a search to an open text file, returns the row count'''
+    names = [name for name, field in EXPORT_COLUMNS]
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(names)
+        for count, row in enumerate(export_rows(entries), 1):
+            writer.writerow(row)
+    else:
+        for count, row in enumerate(export_rows(entries), 1):
+            output.write(json.dumps(dict(zip(names, row))) + '\n')
+    return count
+
+
+def search_entries(args):
+    '''build the search query for the command line arguments'''
+    if args.employee:
+        employee = Employee.get_or_none(Employee.name_key ==
+                                        worklog.employee_key(args.employee))
+        if employee is None:
+            # an unknown name matches nothing, not the entries without an employee
+            return worklog.entries_by_employee(None).where(SQL('0'))
+        return worklog.entries_by_employee(employee.id)
+    elif args.date_from or args.date_to:
+        first_day = worklog.parse_day(args.date_from or args.date_to)
+        last_day = worklog.parse_day(args.date_to or args.date_from)
+        return worklog.entries_by_date(*worklog.day_range(first_day, last_day))
+    elif args.minutes:
+        return worklog.entries_by_duration(*worklog.parse_minutes(args.minutes))
+    elif args.lookup:
+        return worklog.entries_by_lookup(args.lookup)
+    elif args.pattern:
+        worklog.compile_pattern(args.pattern)
+        return worklog.entries_by_pattern(args.pattern)
+    return Entry.select(*worklog.ENTRY_FIELDS).order_by(Entry.employee_name.desc())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export timesheets')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('-o', '--output', default='-',
+                        help='file to write, by default stdout')
+    add_search_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        entries = search_entries(args)
+    except (ValueError, re.error) as error:
+        parser.error(str(error).strip())
+
+    if args.output == '-':
+        try:
+            count = export_entries(entries, sys.stdout, args.format)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # the reader went away early, i.e. piped into head
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as output:
+            count = export_entries(entries, output, args.format)
+    print('{} entries exported'.format(count), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
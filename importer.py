@@ -0,0 +1,103 @@
+# bulk import of timesheets from csv / jsonl files
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+from constants import Constants
+import validation
+import worklog
+
+
+def read_rows(path, file_format=None):
+    '''
+    yield (line number, row) for each timesheet in the file, one at a
+    time so the file is never held in memory. The format is taken from
+    the file extension unless given.
+    '''
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, newline='', encoding='utf-8') as import_file:
+        if file_format == 'csv':
+            reader = csv.DictReader(import_file)
+            for row in reader:
+                yield reader.line_num, row
+        elif file_format in ('jsonl', 'json'):
+            for line_num, line in enumerate(import_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError as error:
+                    yield line_num, error
+        else:
+            raise ValueError('Unknown import format {}, use csv or jsonl'
+                             .format(file_format))
+
+
+def import_rows(rows, chunk_size=Constants.IMPORT_CHUNK_SIZE, progress=None):
+    '''
+    check and save (line number, row) pairs, chunk_size rows per
+    transaction. Rows that fail a check are collected and returned
+    as (line number, row, reason) rather than stopping the import.
+    progress is called with the imported and rejected counts after
+    every chunk.
+    '''
+    now = datetime.datetime.now()
+    imported = 0
+    rejected = []
+
+    for batch in worklog.chunked(rows, chunk_size):
+        work_logs, batch_rejected = validation.check_rows(batch, now)
+        if work_logs:
+            worklog.save_entries(work_logs)
+            imported += len(work_logs)
+        rejected.extend(batch_rejected)
+        if progress:
+            progress(imported, len(rejected))
+
+    return imported, rejected
+
+
+def import_file(path, file_format=None, chunk_size=Constants.IMPORT_CHUNK_SIZE,
+                progress=None):
+    '''import every timesheet in a csv or jsonl file'''
+    return import_rows(read_rows(path, file_format), chunk_size, progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import timesheets. '
+                                     'Columns / keys are the same as the '
+                                     'prompts: Employee Name, Task Completed, '
+                                     'Date Started, Date Completed, Notes.')
+    parser.add_argument('path', help='csv or jsonl file to import')
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help='file format, by default taken from the extension')
+    parser.add_argument('--chunk-size', type=int, default=Constants.IMPORT_CHUNK_SIZE,
+                        help='rows saved per transaction')
+    parser.add_argument('--rejects', help='write rejected rows to this jsonl file')
+    args = parser.parse_args(argv)
+
+    def progress(imported, rejected):
+        print('\r{} imported, {} rejected'.format(imported, rejected),
+              end='', file=sys.stderr)
+
+    imported, rejected = import_file(args.path, args.format,
+                                     args.chunk_size, progress)
+    print(file=sys.stderr)
+
+    if rejected and args.rejects:
+        with open(args.rejects, 'w', encoding='utf-8') as rejects_file:
+            for line_num, row, reason in rejected:
+                rejects_file.write(json.dumps({'line': line_num, 'reason': reason,
+                                               'row': row if isinstance(row, dict) else None}) + '\n')
+    for line_num, row, reason in rejected[:10]:
+        print('line {}: {}'.format(line_num, reason), file=sys.stderr)
+    if len(rejected) > 10:
+        print('... and {} more'.format(len(rejected) - 10), file=sys.stderr)
+
+    return 1 if rejected else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
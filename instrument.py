@@ -0,0 +1,314 @@
+# query timing, per operation counters and the slow query log
+import argparse
+import atexit
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from peewee import SqliteDatabase
+
+from constants import Constants
+
+
+slow_log = logging.getLogger('worklog.slow_queries')
+
+
+class QueryStats:
+    '''
+    Statistics collected while instrumentation is on. Statements are
+    grouped by their SQL, so the same search with different parameters
+    is one line of the report. Each record holds the number of runs,
+    total and worst wall time in milliseconds (execute plus fetching
+    the rows) and the number of rows returned.
+    '''
+
+    def __init__(self, slow_ms=Constants.SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.operations = {}
+        self.total_queries = 0
+        self.total_ms = 0.0
+
+    def record_query(self, sql, params, elapsed_ms, rows):
+        with self.lock:
+            record = self.queries.setdefault(sql, {'count': 0, 'total_ms': 0.0,
+                                                   'max_ms': 0.0, 'rows': 0})
+            record['count'] += 1
+            record['total_ms'] += elapsed_ms
+            record['max_ms'] = max(record['max_ms'], elapsed_ms)
+            record['rows'] += rows
+            self.total_queries += 1
+            self.total_ms += elapsed_ms
+
+    def record_fetch(self, sql, execute_ms, fetch_ms, rows):
+        '''add the fetching of a statement's rows to the run recorded when it executed'''
+        with self.lock:
+            record = self.queries.setdefault(sql, {'count': 0, 'total_ms': 0.0,
+                                                   'max_ms': 0.0, 'rows': 0})
+            record['total_ms'] += fetch_ms
+            record['max_ms'] = max(record['max_ms'], execute_ms + fetch_ms)
+            record['rows'] += rows
+            self.total_ms += fetch_ms
+
+    def record_operation(self, name, queries, elapsed_ms):
+        with self.lock:
+            record = self.operations.setdefault(name, {'count': 0, 'queries': 0,
+                                                       'total_ms': 0.0})
+            record['count'] += 1
+            record['queries'] += queries
+            record['total_ms'] += elapsed_ms
+
+    def totals(self):
+        '''the number of statements recorded so far and their total time'''
+        with self.lock:
+            return self.total_queries, self.total_ms
+
+    def as_dict(self):
+        with self.lock:
+            return {'queries': {sql: dict(record) for sql, record in self.queries.items()},
+                    'operations': {name: dict(record)
+                                   for name, record in self.operations.items()}}
+
+    def save(self, path=Constants.STATS_FILE):
+        '''add the statistics to those already stored in path'''
+        stored = load_stats(path)
+        for section, records in self.as_dict().items():
+            for key, record in records.items():
+                total = stored[section].setdefault(key, dict.fromkeys(record, 0))
+                for measure, value in record.items():
+                    if measure == 'max_ms':
+                        total[measure] = max(total[measure], value)
+                    else:
+                        total[measure] += value
+        with open(path, 'w') as stats_file:
+            json.dump(stored, stats_file, indent=2)
+
+
+class CountingCursor:
+    '''
+    wraps a sqlite3 cursor to time fetching and count the rows read.
+    The statement was recorded when it executed; the fetch time and rows
+    are added once the rows run out, or it is closed or dropped, as it
+    is after .first(), .get() or a count that read a single row.
+    '''
+
+    def __init__(self, cursor, database, sql, params, execute_ms):
+        self.cursor = cursor
+        self.database = database
+        self.sql = sql
+        self.params = params
+        self.execute_ms = execute_ms
+        self.elapsed_ms = 0.0
+        self.rows = 0
+        self.finished = False
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.elapsed_ms += (time.perf_counter() - start) * 1000
+        if row is None:
+            self.finish()
+        else:
+            self.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(size or self.cursor.arraysize)
+        self.elapsed_ms += (time.perf_counter() - start) * 1000
+        self.rows += len(rows)
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self.elapsed_ms += (time.perf_counter() - start) * 1000
+        self.rows += len(rows)
+        self.finish()
+        return rows
+
+    def close(self):
+        self.finish()
+        self.cursor.close()
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.database.fetch_finished(self.sql, self.params, self.execute_ms,
+                                         self.elapsed_ms, self.rows)
+
+    def __del__(self):
+        self.finish()
+
+
+class InstrumentedSqliteDatabase(SqliteDatabase):
+    '''
+    SqliteDatabase that can time every statement. It costs nothing
+    until enable_instrumentation is called.
+    '''
+    stats = None
+
+    def enable_instrumentation(self, slow_ms=Constants.SLOW_QUERY_MS,
+                               slow_log_path=Constants.SLOW_QUERY_LOG):
+        self.stats = QueryStats(slow_ms)
+        if slow_log_path and not slow_log.handlers:
+            handler = logging.FileHandler(slow_log_path)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_log.addHandler(handler)
+            slow_log.setLevel(logging.INFO)
+        return self.stats
+
+    def disable_instrumentation(self):
+        stats, self.stats = self.stats, None
+        return stats
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        if self.stats is None:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        start = time.perf_counter()
+        cursor = super().execute_sql(sql, params, *args, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if cursor.description is None:
+            # nothing to fetch, i.e. an insert or delete
+            self.query_finished(sql, params, elapsed_ms, max(cursor.rowcount, 0))
+            return cursor
+        # recorded now, whether or not its rows are ever all read
+        self.stats.record_query(sql, params, elapsed_ms, 0)
+        return CountingCursor(cursor, self, sql, params, elapsed_ms)
+
+    def query_finished(self, sql, params, elapsed_ms, rows):
+        '''record a statement that had nothing to fetch'''
+        stats = self.stats
+        if stats is None:
+            return
+        stats.record_query(sql, params, elapsed_ms, rows)
+        self.log_if_slow(stats, sql, params, elapsed_ms, rows)
+
+    def fetch_finished(self, sql, params, execute_ms, fetch_ms, rows):
+        '''add the rows read from a statement recorded when it executed'''
+        stats = self.stats
+        if stats is None:
+            return
+        stats.record_fetch(sql, execute_ms, fetch_ms, rows)
+        self.log_if_slow(stats, sql, params, execute_ms + fetch_ms, rows)
+
+    def log_if_slow(self, stats, sql, params, elapsed_ms, rows):
+        if elapsed_ms >= stats.slow_ms:
+            slow_log.info('%.1f ms, %d rows\n%s\nparams: %r\nplan:\n%s\n',
+                          elapsed_ms, rows, sql, params,
+                          self.query_plan(sql, params))
+
+    def query_plan(self, sql, params):
+        '''the EXPLAIN QUERY PLAN output for a select, as indented lines'''
+        if not re.match(r'\s*(SELECT|WITH)\b', sql, re.IGNORECASE):
+            return '  (not a select)'
+        try:
+            plan = self.connection().execute('EXPLAIN QUERY PLAN ' + sql,
+                                             params or ()).fetchall()
+        except Exception as error:
+            return '  (no plan: {})'.format(error)
+        depth = {0: 0}
+        lines = []
+        for node, parent, _, detail in plan:
+            depth[node] = depth.get(parent, 0) + 1
+            lines.append('  ' * depth[node] + detail)
+        return '\n'.join(lines)
+
+
+def instrumented(operation):
+    '''
+    count the calls of a work log operation (add, search, display,
+    delete) and the statements and database time they used, while
+    instrumentation is on. Wall time is not counted as most of it is
+    spent waiting for the user to type.
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self._meta.database.stats
+            if stats is None:
+                return method(self, *args, **kwargs)
+            queries, elapsed_ms = stats.totals()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                total_queries, total_ms = stats.totals()
+                stats.record_operation(operation, total_queries - queries,
+                                       total_ms - elapsed_ms)
+        return wrapper
+    return decorator
+
+
+def enable_from_environment(database):
+    '''
+    switch instrumentation on when WORKLOG_INSTRUMENT is set, saving the
+    statistics to Constants.STATS_FILE when the program exits
+    '''
+    if os.environ.get('WORKLOG_INSTRUMENT'):
+        slow_ms = float(os.environ.get('WORKLOG_SLOW_QUERY_MS', Constants.SLOW_QUERY_MS))
+        stats = database.enable_instrumentation(slow_ms)
+        atexit.register(stats.save)
+
+
+def load_stats(path=Constants.STATS_FILE):
+    try:
+        with open(path) as stats_file:
+            return json.load(stats_file)
+    except FileNotFoundError:
+        return {'queries': {}, 'operations': {}}
+
+
+def print_stats(stats, limit=20, output=sys.stdout):
+    '''the operation counters and the statements taking the most time'''
+    print('{:<10} {:>8} {:>10} {:>12} {:>10}'.format(
+        'operation', 'count', 'queries', 'db ms', 'avg db ms'), file=output)
+    for name, record in sorted(stats['operations'].items()):
+        print('{:<10} {:>8} {:>10} {:>12.1f} {:>10.2f}'.format(
+            name, record['count'], record['queries'], record['total_ms'],
+            record['total_ms'] / record['count']), file=output)
+
+    print('\n{:>8} {:>12} {:>10} {:>10} {:>10}  sql'.format(
+        'count', 'total ms', 'avg ms', 'max ms', 'rows'), file=output)
+    queries = sorted(stats['queries'].items(), key=lambda item: -item[1]['total_ms'])
+    for sql, record in queries[:limit]:
+        print('{:>8} {:>12.1f} {:>10.2f} {:>10.2f} {:>10}  {}'.format(
+            record['count'], record['total_ms'], record['total_ms'] / record['count'],
+            record['max_ms'], record['rows'], ' '.join(sql.split())[:200]),
+            file=output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the query statistics '
+                                     'collected with WORKLOG_INSTRUMENT=1')
+    parser.add_argument('--file', default=Constants.STATS_FILE)
+    parser.add_argument('--limit', type=int, default=20,
+                        help='number of statements to show')
+    parser.add_argument('--json', action='store_true', help='print the raw statistics')
+    parser.add_argument('--reset', action='store_true', help='clear the statistics')
+    args = parser.parse_args(argv)
+
+    if args.reset:
+        if os.path.exists(args.file):
+            os.remove(args.file)
+        print('The query statistics have been cleared!')
+    elif args.json:
+        json.dump(load_stats(args.file), sys.stdout, indent=2)
+    else:
+        print_stats(load_stats(args.file), args.limit)
+
+if __name__ == '__main__':
+    main()
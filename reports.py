@@ -0,0 +1,257 @@
+# time reports per employee per day / week / month
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import datetime
+import os
+import sqlite3
+import sys
+from urllib.parse import quote
+
+from peewee import SQL, fn
+
+from constants import Constants
+import worklog
+from worklog import Employee, Entry, TimeSummary, worklog_db
+
+
+# read-only connections of a report worker process, by database file
+report_connections = {}
+
+
+def time_report(period, employee_name=None, first_day=None, last_day=None):
+    '''
+    total time per employee for each day, week or month, newest first,
+    read from the time summaries. Returns a query of (employee name,
+    period start, total seconds, number of entries).
+    '''
+    report = (TimeSummary
+              .select(Employee.name, TimeSummary.period_start,
+                      TimeSummary.total_time, TimeSummary.entry_count)
+              .join(Employee)
+              .where(TimeSummary.period == period)
+              .order_by(TimeSummary.period_start.desc(), Employee.name))
+    if employee_name:
+        report = report.where(Employee.name_key == worklog.employee_key(employee_name))
+    if first_day:
+        # the period containing first_day starts on or before it
+        report = report.where(TimeSummary.period_start >=
+                              worklog.period_start(period, first_day))
+    if last_day:
+        report = report.where(TimeSummary.period_start <= last_day.isoformat())
+    return report
+
+
+def report_chunks(query, first_day=None, last_day=None):
+    '''
+    split an aggregate query over the entries into (database file, sql,
+    params) chunks, one per month of entries in the main database and in
+    each archive, restricted to first_day - last_day when given
+    '''
+    chunks = []
+    for schema in worklog.search_partitions():
+        with worklog.partition(schema):
+            oldest, newest = (Entry.select(fn.MIN(Entry.date_started),
+                                           fn.MAX(Entry.date_started))
+                              .scalar(as_tuple=True))
+            files = {name: path for _, name, path
+                     in worklog_db.execute_sql('PRAGMA database_list')}
+        if oldest is None:
+            continue
+        first = max(oldest.date(), first_day or datetime.date.min)
+        last = min(newest.date(), last_day or datetime.date.max)
+        month = first.replace(day=1)
+        while month <= last:
+            start, end = worklog.period_range('month', month.isoformat())
+            start, end = worklog.day_range(max(start.date(), first), min(end.date(), last))
+            # rendered outside partition(), so it names the plain entry
+            # table of whichever file runs it
+            sql, params = query.where(Entry.date_started.between(start, end)).sql()
+            chunks.append((files[schema or 'main'], sql, params))
+            month = end.date() + datetime.timedelta(days=1)
+    return chunks
+
+
+def run_chunk(chunk):
+    '''run one chunk in a worker process, on its own read-only connection'''
+    path, sql, params = chunk
+    connection = report_connections.get(path)
+    if connection is None:
+        uri = 'file:{}?mode=ro'.format(quote(os.path.abspath(path)))
+        connection = report_connections[path] = sqlite3.connect(uri, uri=True)
+    return connection.execute(sql, params).fetchall()
+
+
+def aggregate(query, first_day=None, last_day=None, workers=Constants.REPORT_WORKERS):
+    '''
+    run a query that selects its GROUP BY columns then SUM / COUNT
+    columns chunk by chunk, on workers processes, and add up the partial
+    rows. The totals are whole numbers so they match a single query
+    exactly. Returns {leading columns: [totals]}.
+    '''
+    chunks = report_chunks(query, first_day, last_day)
+    key_length = len(query._group_by)
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(min(workers, len(chunks))) as executor:
+            results = list(executor.map(run_chunk, chunks))
+    else:
+        results = map(run_chunk, chunks)
+
+    totals = {}
+    for rows in results:
+        for row in rows:
+            total = totals.setdefault(row[:key_length], [0] * (len(row) - key_length))
+            for index, value in enumerate(row[key_length:]):
+                total[index] += value or 0
+    return totals
+
+
+def employee_filter(query, employee_name):
+    if employee_name:
+        employee = Employee.get_or_none(Employee.name_key ==
+                                        worklog.employee_key(employee_name))
+        # an unknown name matches nothing, not the entries without an employee
+        query = query.where(Entry.employee == employee.id if employee else SQL('0'))
+    return query
+
+
+def entry_report(period, employee_name=None, first_day=None, last_day=None,
+                 workers=Constants.REPORT_WORKERS):
+    '''
+    total time per employee for each day, week, month or year, added up
+    from the entries themselves rather than the summaries, in the same
+    (employee name, period start, total seconds, number of entries)
+    rows and order as time_report. Only entries from first_day to
+    last_day are counted, so the first and last periods may be partial.
+    '''
+    bucket = worklog.bucket_expression(period)
+    # grouped by employee id, as the archives have no directory to join,
+    # and like the summaries leaving out entries without an employee
+    query = employee_filter(Entry
+                            .select(Entry.employee, bucket,
+                                    fn.SUM(Entry.time_taken), fn.COUNT(Entry.id))
+                            .where(Entry.employee.is_null(False))
+                            .group_by(Entry.employee, bucket), employee_name)
+    totals = aggregate(query, first_day, last_day, workers)
+    names = dict(Employee
+                 .select(Employee.id, Employee.name)
+                 .where(Employee.id.in_({employee_id for employee_id, _ in totals}))
+                 .tuples())
+    rows = sorted((names[employee_id], start) + tuple(total)
+                  for (employee_id, start), total in totals.items())
+    # newest period first, employees in name order within it
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+def duration_histogram(minutes=Constants.HISTOGRAM_MINUTES, employee_name=None,
+                       first_day=None, last_day=None, workers=Constants.REPORT_WORKERS):
+    '''
+    the number of entries and their total time in bands of time taken,
+    minutes wide. Returns (band start in minutes, number of entries,
+    total seconds) rows, shortest first.
+    '''
+    band = (Entry.time_taken / (minutes * 60)) * minutes
+    query = employee_filter(Entry
+                            .select(band, fn.COUNT(Entry.id), fn.SUM(Entry.time_taken))
+                            .group_by(band), employee_name)
+    totals = aggregate(query, first_day, last_day, workers)
+    return sorted(key + tuple(total) for key, total in totals.items())
+
+
+def print_histogram(rows, minutes, output=sys.stdout, file_format='text'):
+    '''write a duration histogram as a table or csv'''
+    if file_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(['Minutes', 'Entries', 'Seconds'])
+        writer.writerows(rows)
+        return
+
+    print('{:<14} {:>8} {:>10}'.format('Minutes', 'Entries', 'Hours'), file=output)
+    for start, count, seconds in rows:
+        print('{:<14} {:>8} {:>10}'.format('{}-{}'.format(start, start + minutes),
+                                           count, format_hours(seconds)), file=output)
+
+
+def format_hours(seconds):
+    '''seconds as hours and minutes, i.e. 5:07'''
+    hours, mins = divmod(seconds // 60, 60)
+    return '{}:{:02d}'.format(hours, mins)
+
+
+def print_report(report, period, output=sys.stdout, file_format='text'):
+    '''write a time report, a query or a list of its rows, as a table or csv'''
+    rows = report if isinstance(report, list) else report.tuples().iterator()
+    if file_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(['Employee Name', period.title(), 'Seconds', 'Entries'])
+        for row in rows:
+            writer.writerow(row)
+        return
+
+    print('{:<30} {:<12} {:>10} {:>8}'.format('Employee Name', period.title(),
+                                           'Hours', 'Entries'), file=output)
+    for name, start, seconds, count in rows:
+        print('{:<30} {:<12} {:>10} {:>8}'.format(name, start, format_hours(seconds),
+                                               count), file=output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time reports per employee')
+    parser.add_argument('--period', default='week',
+                        choices=list(Constants.CALENDAR_PERIODS.values()) + ['year'],
+                        help='year reads the entries, as --entries does')
+    parser.add_argument('--employee', help='full name of the employee')
+    parser.add_argument('--from', dest='date_from', metavar='DD/MM/YY',
+                        help='first day to report on')
+    parser.add_argument('--to', dest='date_to', metavar='DD/MM/YY',
+                        help='last day to report on')
+    parser.add_argument('--format', choices=['text', 'csv'], default='text')
+    parser.add_argument('--entries', action='store_true',
+                        help='add up the entries themselves instead of reading '
+                             'the summaries, in parallel')
+    parser.add_argument('--histogram', type=int, nargs='?', metavar='MINUTES',
+                        const=Constants.HISTOGRAM_MINUTES,
+                        help='number of entries per band of time taken, '
+                             'by default {} minutes wide'.format(Constants.HISTOGRAM_MINUTES))
+    parser.add_argument('--workers', type=int, default=Constants.REPORT_WORKERS,
+                        help='processes used by --entries and --histogram, '
+                             '1 runs them in this process')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='recalculate the summaries from every entry')
+    parser.add_argument('--check', action='store_true',
+                        help='compare the summaries with the entries')
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        worklog.rebuild_summaries()
+        print('The time summaries have been rebuilt!')
+        return 0
+    if args.check:
+        differences = worklog.check_summaries()
+        for employee_id, period, start, stored, actual in differences:
+            print('employee {} {} {}: summary {} entries {}'
+                  .format(employee_id, period, start, stored, actual))
+        print('{} differences found'.format(len(differences)))
+        return 1 if differences else 0
+
+    try:
+        first_day = worklog.parse_day(args.date_from) if args.date_from else None
+        last_day = worklog.parse_day(args.date_to) if args.date_to else None
+    except ValueError as error:
+        parser.error(str(error).strip())
+
+    if args.histogram:
+        rows = duration_histogram(args.histogram, args.employee, first_day, last_day,
+                                  args.workers)
+        print_histogram(rows, args.histogram, file_format=args.format)
+    elif args.entries or args.period == 'year':
+        report = entry_report(args.period, args.employee, first_day, last_day,
+                              args.workers)
+        print_report(report, args.period, file_format=args.format)
+    else:
+        report = time_report(args.period, args.employee, first_day, last_day)
+        print_report(report, args.period, file_format=args.format)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
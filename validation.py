@@ -0,0 +1,206 @@
+# checks for the values of an entry, built from Constants.INPUT_CHECK
+#
+# The same checks serve the interactive prompts (check_* raise
+# ValueError with the message to show) and batches of rows (check_rows
+# returns the reason each bad row is rejected, without raising). A batch
+# is checked against one "now", and dates in the INPUT_CHECK format are
+# read by a parser compiled from it rather than by strptime.
+import calendar
+import datetime
+import re
+
+from constants import Constants
+
+
+RULES = Constants.INPUT_CHECK
+
+NAME_PATTERN = re.compile(RULES['EMP_C']['match'])
+TASK_MIN = RULES['GLT_C']['>=']
+TASK_MAX = RULES['GLT_C']['=<']
+DATE_FORMAT = RULES['DATE_C']['date']
+
+# the strptime directives the fast parser knows, as named groups
+DATE_DIRECTIVES = {'%d': r'(?P<day>\d{1,2})', '%m': r'(?P<month>\d{1,2})',
+                   '%y': r'(?P<year>\d{2})', '%Y': r'(?P<century_year>\d{4})',
+                   '%H': r'(?P<hour>\d{1,2})', '%M': r'(?P<minute>\d{1,2})'}
+
+
+def compile_date_pattern(date_format):
+    '''
+    a regular expression matching the dates strptime reads with
+    date_format, or None if it uses a directive not in DATE_DIRECTIVES
+    '''
+    pattern = []
+    for part in re.split(r'(%.|\s+)', date_format):
+        if part in DATE_DIRECTIVES:
+            pattern.append(DATE_DIRECTIVES[part])
+        elif part.startswith('%'):
+            return None
+        elif part.isspace():
+            pattern.append(r'\s+')
+        else:
+            pattern.append(re.escape(part))
+    return re.compile(''.join(pattern), re.ASCII)
+
+
+DATE_PATTERN = compile_date_pattern(DATE_FORMAT)
+
+
+def read_date(date_input, date_format=DATE_FORMAT, pattern=DATE_PATTERN):
+    '''
+    read a date in date_format, the same as strptime would, or None when
+    it is not one. Dates the pattern matches are built from its groups;
+    anything else is left to strptime.
+    '''
+    if not isinstance(date_input, str):
+        return None
+    match = pattern.fullmatch(date_input) if pattern else None
+    if match is None:
+        try:
+            return datetime.datetime.strptime(date_input, date_format)
+        except ValueError:
+            return None
+
+    parts = match.groupdict()
+    if 'century_year' in parts:
+        year = int(parts['century_year'])
+    else:
+        # strptime's pivot, 69 - 99 are 1969 - 1999
+        year = int(parts['year'])
+        year += 1900 if year >= 69 else 2000
+    month = int(parts.get('month', 1))
+    day = int(parts.get('day', 1))
+    hour = int(parts.get('hour', 0))
+    minute = int(parts.get('minute', 0))
+    if not (1 <= month <= 12 and 1 <= day and hour < 24 and minute < 60):
+        return None
+    if day > 28 and day > calendar.monthrange(year, month)[1]:
+        return None
+    return datetime.datetime(year, month, day, hour, minute)
+
+
+def name_error(employee_name):
+    if isinstance(employee_name, str) and NAME_PATTERN.match(employee_name):
+        return None
+    return RULES['EMP_MSG']
+
+
+def task_error(task):
+    if isinstance(task, str) and TASK_MIN <= len(task) <= TASK_MAX:
+        return None
+    return RULES['GLT_MSG']
+
+
+def date_started_error(date_started, now):
+    if date_started is None:
+        return RULES['DATE_MSG']
+    if date_started >= now:
+        return RULES['DATE_S_MSG']
+    return None
+
+
+def date_completed_error(date_completed, date_started, now):
+    if date_completed is None:
+        return RULES['DATE_MSG']
+    if date_completed <= date_started or date_completed >= now:
+        return RULES['DATE_C_MSG']
+    return None
+
+
+def raise_error(error):
+    if error:
+        raise ValueError(error)
+
+
+def check_employee_name(employee_name):
+    '''the name must follow the convention of 'first name last name' '''
+    raise_error(name_error(employee_name))
+    return employee_name
+
+
+def check_task(task):
+    '''a task must be given and cannot be more than 30 characters long'''
+    raise_error(task_error(task))
+    return task
+
+
+def parse_date(date_input):
+    '''read a dd/mm/yy hh:mm date'''
+    date = read_date(date_input)
+    raise_error(None if date else RULES['DATE_MSG'])
+    return date
+
+
+def check_date_started(date_input, now=None):
+    '''the start date cannot be in the future'''
+    date_started = read_date(date_input)
+    raise_error(date_started_error(date_started, now or datetime.datetime.now()))
+    return date_started
+
+
+def check_date_completed(date_input, date_started, now=None):
+    '''the completed date must be after the start date and not in the future'''
+    date_completed = read_date(date_input)
+    raise_error(date_completed_error(date_completed, date_started,
+                                     now or datetime.datetime.now()))
+    return date_completed
+
+
+def total_time(date_started, date_completed):
+    '''the time spent on a task in seconds, and as a readable string'''
+    time_taken = round((date_completed - date_started).total_seconds())
+    return time_taken, format_time_taken(time_taken)
+
+
+def format_time_taken(time_taken):
+    '''seconds as hours and minutes, i.e. 0.0 hours 45.0 minutes'''
+    hours, mins = divmod(time_taken // 60, 60)
+    return '{} hours {} minutes'.format(float(hours), float(mins))
+
+
+def check_row(row, now):
+    '''
+    check a row with the keys of Constants.IMPORT_COLUMNS, returns
+    (work log ready for worklog.save_entries, None) or (None, the
+    reason it is rejected)
+    '''
+    if not isinstance(row, dict):
+        return None, 'Invalid row, {}'.format(row)
+    for column in Constants.IMPORT_COLUMNS:
+        if not isinstance(row.get(column), str):
+            return None, 'Missing column {}'.format(column)
+
+    date_started = read_date(row['Date Started'])
+    date_completed = read_date(row['Date Completed'])
+    error = (name_error(row['Employee Name']) or task_error(row['Task Completed']) or
+             date_started_error(date_started, now) or
+             date_completed_error(date_completed, date_started, now))
+    if error:
+        return None, error.strip()
+
+    time_taken, time_str = total_time(date_started, date_completed)
+    return {'Employee Name': row['Employee Name'],
+            'Task Completed': row['Task Completed'],
+            'Date Started': date_started,
+            'Date Completed': date_completed,
+            'Time Taken': time_taken,
+            'Time String': time_str,
+            'Notes': str(row.get('Notes') or '').strip()}, None
+
+
+def check_rows(rows, now=None):
+    '''
+    check a batch of (key, row) pairs, i.e. line numbers and rows,
+    against one now. Returns the work logs of the good rows and
+    (key, row, reason) for each row rejected.
+    '''
+    now = now or datetime.datetime.now()
+    work_logs = []
+    rejected = []
+    for key, row in rows:
+        work_log, reason = check_row(row, now)
+        if reason:
+            rejected.append((key, row, reason))
+        else:
+            work_logs.append(work_log)
+    return work_logs, rejected
@@ -1,32 +1,1687 @@
 #! usr/bin/env python 3
 
 # command line journal/diary
-from collections import OrderedDict
+import argparse
+import atexit
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
 import datetime
+import functools
+import heapq
+import itertools
+import json
+import operator
+import os
+import queue
+import random
 import re
+import sqlite3
 import sys
+import threading
+import time
+import zlib
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
 
 
 from peewee import *
+from peewee import FieldAccessor, Metadata, Node
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.sqlite_ext import AutoIncrementField, FTS5Model, RowIDField, SearchField
 
 from constants import Constants
+from instrument import InstrumentedSqliteDatabase, enable_from_environment, instrumented
 from menu import Menu
 from utils import clear_screen
+from validation import (check_date_completed, check_date_started, check_employee_name,
+                        check_task, format_time_taken, total_time)
+
+
+def database_profile(name=None):
+    '''
+    the pragmas for a connection profile in Constants.DB_PROFILES, by
+    default the one named by WORKLOG_DB_PROFILE. Single settings can be
+    overridden with WORKLOG_DB_PRAGMAS i.e. "cache_size=-20000,mmap_size=0"
+    '''
+    name = name or os.environ.get('WORKLOG_DB_PROFILE', 'default')
+    if name not in Constants.DB_PROFILES:
+        raise ValueError('Unknown database profile {}, choose from {}'
+                         .format(name, ', '.join(Constants.DB_PROFILES)))
+    pragmas = dict(Constants.DB_PROFILES[name])
+    for setting in os.environ.get('WORKLOG_DB_PRAGMAS', '').split(','):
+        if '=' in setting:
+            key, value = setting.split('=', 1)
+            pragmas[key.strip()] = value.strip()
+    return pragmas
+
+
+def retry_on_lock(write):
+    '''
+    retry a write that fails because another process holds the lock,
+    backing off a little longer each time. Only whole transactions are
+    retried, inside someone else's transaction the error is passed on.
+    '''
+    @functools.wraps(write)
+    def retry(*args, **kwargs):
+        delay = Constants.DB_RETRY_DELAY
+        for attempt in range(Constants.DB_WRITE_RETRIES):
+            try:
+                return write(*args, **kwargs)
+            except OperationalError as error:
+                locked = 'locked' in str(error) or 'busy' in str(error)
+                if not locked or worklog_db.in_transaction():
+                    raise
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay *= 2
+        return write(*args, **kwargs)
+    return retry
+
+
+class WorkLogDatabase(InstrumentedSqliteDatabase):
+    '''
+    the one database handle shared by everything in the process.
+    Nothing is opened until the first query, every thread is given its
+    own connection, and the schema is checked (and migrated if behind)
+    once per process - later connections trust the cached version.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.schema_lock = threading.RLock()
+        self.connections_lock = threading.Lock()
+        self.connections = set()
+        self.schema_version = None
+        super().__init__(*args, **kwargs)
+
+    def init(self, database, **kwargs):
+        '''point the handle at another file, its schema is checked afresh'''
+        # each connection is only used by the thread that opened it, but
+        # close_all closes them all from the thread that is exiting
+        kwargs.setdefault('check_same_thread', False)
+        super().init(database, **kwargs)
+        self.schema_version = None
+
+    def connect(self, reuse_if_open=False):
+        opened = super().connect(reuse_if_open)
+        self.check_schema()
+        return opened
+
+    def check_schema(self):
+        '''run migrate_database the first time any thread connects'''
+        if self.schema_version is not None:
+            return
+        with self.schema_lock:
+            if self.schema_version is None:
+                migrate_database()
+                self.schema_version = self.pragma('user_version')
+
+    def _connect(self):
+        conn = super()._connect()
+        with self.connections_lock:
+            self.connections.add(conn)
+        return conn
+
+    def _close(self, conn):
+        with self.connections_lock:
+            self.connections.discard(conn)
+        super()._close(conn)
+
+    def close_all(self):
+        '''close the connection of every thread, i.e. when the program exits'''
+        if self.deferred:
+            return
+        if not self.in_transaction():
+            self.close()
+        with self.connections_lock:
+            connections, self.connections = self.connections, set()
+        for conn in connections:
+            conn.close()
+
+
+worklog_db = WorkLogDatabase(os.environ.get('WORKLOG_DB', 'worklog.db'),
+                             pragmas=database_profile())
+enable_from_environment(worklog_db)
+atexit.register(worklog_db.close_all)
+
+# bump this and add a step to MIGRATIONS whenever the schema changes
+SCHEMA_VERSION = 10
+
+# the schema the partitioned models are read from on this thread, None
+# for the main database. See partition().
+partition_state = threading.local()
+
 
+class PartitionMetadata(Metadata):
+    '''
+    model metadata whose schema can be switched for one thread at a
+    time, so the same query can be rendered against the entries of an
+    attached archive database
+    '''
+
+    @property
+    def schema(self):
+        return getattr(partition_state, 'schema', None) or self._schema
+
+    @schema.setter
+    def schema(self, value):
+        self._schema = value
+        self._tables = {}
+
+    @property
+    def table(self):
+        schema = self.schema
+        if schema not in self._tables:
+            self._tables[schema] = Table(
+                self.table_name, [field.column_name for field in self.sorted_fields],
+                schema=schema, _model=self.model, _database=self.database)
+        return self._tables[schema]
+
+    @table.deleter
+    def table(self):
+        self._tables = {}
+
+
+@contextmanager
+def partition(schema):
+    '''
+    render queries on Entry and EntryIndex against an archive schema,
+    attaching its file to this thread's connection if it is not already
+    '''
+    if schema:
+        attach_archive(archive_year(schema))
+    previous = getattr(partition_state, 'schema', None)
+    partition_state.schema = schema
+    try:
+        yield
+    finally:
+        partition_state.schema = previous
+
+@worklog_db.func('employee_key', deterministic=True)
+def employee_key(employee_name):
+    '''
+    the directory key of a name. Upper cased by python, as SQLite's
+    UPPER() only folds ASCII and would key 'josé' and 'JOSÉ' apart.
+    '''
+    return employee_name.upper() if employee_name is not None else None
+
+
+class Employee(Model):
+    '''
+    directory of everyone who has logged time. name_key is the name
+    through employee_key() so 'stuart mcintosh' and 'Stuart McIntosh'
+    are one employee.
+    '''
+    name = CharField(max_length=255)
+    name_key = CharField(max_length=255, unique=True)
+
+    class Meta:
+        database = worklog_db
+
+class DeferredAccessor(FieldAccessor):
+    '''
+    a column left out of the query that read an entry, i.e. its notes, is
+    read by id the first time it is used - from the archive the entry
+    came from when find_entry found it in one
+    '''
+
+    def __get__(self, instance, instance_type=None):
+        if (instance is not None and self.name not in instance.__data__ and
+                instance._pk is not None):
+            model = self.model
+            with partition(getattr(instance, 'partition_schema', None)):
+                instance.__data__[self.name] = (model
+                                                .select(self.field)
+                                                .where(model._meta.primary_key == instance._pk)
+                                                .scalar())
+        return super().__get__(instance, instance_type)
+
+
+class NotesField(TextField):
+    '''
+    notes longer than Constants.NOTES_COMPRESS_BYTES are stored zlib
+    compressed, as a blob, when that makes them smaller; shorter notes
+    stay text. The work log reads them in SQL with notes_text(notes),
+    the triggers do not so other tools can still write to entry.
+    '''
+    accessor_class = DeferredAccessor
+
+    def db_value(self, value):
+        value = super().db_value(value)
+        limit = Constants.NOTES_COMPRESS_BYTES
+        if value is None or limit is None:
+            return value
+        encoded = value.encode('utf-8')
+        if len(encoded) <= limit:
+            return value
+        compressed = zlib.compress(encoded, Constants.NOTES_COMPRESS_LEVEL)
+        return compressed if len(compressed) < len(encoded) else value
+
+    def python_value(self, value):
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode('utf-8')
+        return value
 
-worklog_db = SqliteDatabase('worklog.db')
 
 class Entry(Model):
-    employee_name = CharField(max_length=255)
+    employee = ForeignKeyField(Employee, null=True, index=False,
+                               backref='entries')
+    employee_name = CharField(max_length=255, index=True)
     completed_task = CharField(max_length=30)
-    date_started = DateTimeField()
-    date_completed = DateTimeField()
-    notes = TextField()
+    # epoch seconds, so dates sort and compare as numbers. The times
+    # typed in have no time zone, they are stored as if they were UTC
+    # so they read back exactly as entered
+    date_started = TimestampField(utc=True)
+    date_completed = TimestampField(utc=True)
+    notes = NotesField()
     time_taken = IntegerField()
-    time_string = CharField()
+
+    @property
+    def time_string(self):
+        '''the time taken as a readable string, it is not stored'''
+        return format_time_taken(self.time_taken)
+
+    class Meta:
+        database = worklog_db
+        model_metadata_class = PartitionMetadata
+        # the searches filter on employee / date / duration and sort on
+        # employee name, so lead with the filter column and finish with
+        # the sort column
+        indexes = (
+            (('employee', 'employee_name'), False),
+            (('date_started', 'employee_name'), False),
+            (('time_taken', 'employee_name'), False),
+        )
+
+
+# every column but the notes, for queries that return entries; the notes
+# of an entry are read when they are first used
+ENTRY_FIELDS = tuple(field for field in Entry._meta.sorted_fields
+                     if not isinstance(field, NotesField))
+
+
+class TimeSummary(Model):
+    '''
+    total time and number of entries per employee per day, week and
+    month. Kept up to date by the write path (save_entries and
+    delete_entries) so reports never aggregate the entry table.
+    period_start is the first day of the period as 'YYYY-MM-DD',
+    weeks start on a Monday.
+    '''
+    employee = ForeignKeyField(Employee, backref='summaries')
+    period = CharField(max_length=5)
+    period_start = CharField(max_length=10)
+    total_time = IntegerField(default=0)
+    entry_count = IntegerField(default=0)
+
+    class Meta:
+        database = worklog_db
+        table_name = 'time_summary'
+        indexes = (
+            (('employee', 'period', 'period_start'), True),
+            (('period', 'period_start'), False),
+        )
+
+
+class ArchivedMonth(Model):
+    '''
+    the months whose entries have been moved out of the main database
+    into an archive file, one file per year (see archive.py)
+    '''
+    month = CharField(max_length=7, unique=True)
+    path = CharField()
+    entry_count = IntegerField(default=0)
+    max_id = IntegerField(default=0)
+
+    class Meta:
+        database = worklog_db
+        table_name = 'archived_month'
+
+
+class EntryChange(Model):
+    '''
+    append-only log of every insert, update and delete of an entry in
+    the main database, for jobs that sync incrementally. It is written
+    by triggers on entry so no writer is missed, and seq only ever
+    increases. data is the entry as a json object - the new row, or the
+    row deleted. changed_at is UTC.
+    '''
+    seq = AutoIncrementField()
+    operation = CharField(max_length=6)
+    entry_id = IntegerField()
+    changed_at = TimestampField(utc=True)
+    data = TextField()
+
+    class Meta:
+        database = worklog_db
+        table_name = 'entry_change'
+
+
+class EntryIndex(FTS5Model):
+    '''
+    full text index over the task and notes of each entry. It keeps its
+    own copy of the text, so searches and snippets never read the
+    compressed notes. The triggers below keep it in step with every
+    insert, update and delete using plain SQL; notes stored compressed
+    are indexed by index_notes, from the python that wrote them.
+    '''
+    rowid = RowIDField()
+    completed_task = SearchField()
+    notes = SearchField()
 
     class Meta:
         database = worklog_db
+        model_metadata_class = PartitionMetadata
+        table_name = 'entry_index'
+        options = {'tokenize': 'porter unicode61'}
+
+
+@worklog_db.func('notes_text', deterministic=True)
+def notes_text(notes):
+    '''the function SQLite calls to read notes that may be compressed'''
+    return Entry.notes.python_value(notes)
+
+
+# the notes as text in a query, only the compressed ones go through python
+NOTES_TEXT = Case(None, [(fn.typeof(Entry.notes) == 'blob', fn.notes_text(Entry.notes))],
+                  Entry.notes)
+
+# the triggers only copy notes stored as text, an update that compresses
+# the notes leaves the index alone
+ENTRY_INDEX_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS {schema}entry_index_insert AFTER INSERT ON entry
+       BEGIN
+           INSERT INTO entry_index (rowid, completed_task, notes)
+           VALUES (new.id, new.completed_task,
+                   CASE typeof(new.notes) WHEN 'text' THEN new.notes END);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS {schema}entry_index_delete AFTER DELETE ON entry
+       BEGIN
+           DELETE FROM entry_index WHERE rowid = old.id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS {schema}entry_index_update
+       AFTER UPDATE OF completed_task, notes ON entry
+       WHEN old.completed_task IS NOT new.completed_task
+           OR (typeof(new.notes) = 'text' AND old.notes IS NOT new.notes)
+       BEGIN
+           UPDATE entry_index
+           SET completed_task = new.completed_task,
+               notes = CASE typeof(new.notes) WHEN 'text' THEN new.notes ELSE notes END
+           WHERE rowid = new.id;
+       END''',
+]
+
+
+def create_search_index(schema=None):
+    '''create the full text index and the triggers that maintain it'''
+    with partition(schema):
+        worklog_db.create_tables([EntryIndex], safe=True)
+    for trigger in ENTRY_INDEX_TRIGGERS:
+        worklog_db.execute_sql(trigger.format(schema='"{}".'.format(schema)
+                                              if schema else ''))
+
+
+def fill_search_index(schema=None):
+    '''index every entry of a schema again, reading the compressed notes'''
+    prefix = '"{}".'.format(schema) if schema else ''
+    worklog_db.execute_sql('DELETE FROM {}entry_index'.format(prefix))
+    worklog_db.execute_sql(
+        'INSERT INTO {0}entry_index (rowid, completed_task, notes) '
+        "SELECT id, completed_task, CASE typeof(notes) WHEN 'blob' "
+        'THEN notes_text(notes) ELSE notes END FROM {0}entry'.format(prefix))
+
+
+def index_notes(schema, entry_ids):
+    '''
+    index the notes of entries just written that were stored compressed,
+    which the triggers cannot read
+    '''
+    prefix = '"{}".'.format(schema) if schema else ''
+    for batch in chunked(entry_ids, 500):
+        worklog_db.execute_sql(
+            'UPDATE {0}entry_index SET notes = (SELECT notes_text(notes) FROM {0}entry '
+            'WHERE id = entry_index.rowid) WHERE rowid IN (SELECT id FROM {0}entry '
+            "WHERE typeof(notes) = 'blob' AND id IN ({1}))"
+            .format(prefix, ', '.join('?' * len(batch))), batch)
+
+
+def recreate_search_index(schema=None):
+    '''
+    drop the full text index of a schema and its triggers, and build
+    them again - for files indexed before notes could be compressed, or
+    whose index read the notes through the entry_text view
+    '''
+    prefix = '"{}".'.format(schema) if schema else ''
+    triggers = worklog_db.execute_sql(
+        "SELECT name FROM {}sqlite_master WHERE type = 'trigger' "
+        "AND name LIKE 'entry_index_%'".format(prefix)).fetchall()
+    for name, in triggers:
+        worklog_db.execute_sql('DROP TRIGGER {}"{}"'.format(prefix, name))
+    worklog_db.execute_sql('DROP TABLE IF EXISTS {}entry_index'.format(prefix))
+    worklog_db.execute_sql('DROP VIEW IF EXISTS {}entry_text'.format(prefix))
+    create_search_index(schema)
+    fill_search_index(schema)
+
+
+def search_index_current(schema=None):
+    '''whether the full text index of a schema keeps its own copy of the text'''
+    prefix = '"{}".'.format(schema) if schema else ''
+    row = worklog_db.execute_sql("SELECT sql FROM {}sqlite_master "
+                                 "WHERE name = 'entry_index'".format(prefix)).fetchone()
+    return row is None or 'content' not in row[0]
+
+
+CHANGE_FEED_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS entry_change_{operation}
+       AFTER {event} ON entry {when}
+       BEGIN
+           INSERT INTO entry_change (operation, entry_id, changed_at, data)
+           VALUES ('{operation}', {row}.id, {now}, {data});
+       END'''
+
+CHANGE_FEED_EVENTS = (('insert', 'INSERT', 'new'), ('update', 'UPDATE', 'new'),
+                      ('delete', 'DELETE', 'old'))
+
+
+def change_data(row):
+    '''
+    SQL for an entry as a json object, row is new / old or a table.
+    Compressed notes are logged as {"zlib": hex}, changes_after reads
+    them back as text.
+    '''
+    columns = []
+    for field in Entry._meta.sorted_fields:
+        column = '{}."{}"'.format(row, field.column_name)
+        if isinstance(field, NotesField):
+            column = ("CASE typeof({0}) WHEN 'blob' THEN json_object('zlib', hex({0})) "
+                      'ELSE {0} END'.format(column))
+        columns.append("'{}', {}".format(field.column_name, column))
+    return 'json_object({})'.format(', '.join(columns))
+
+
+def create_change_feed(events=CHANGE_FEED_EVENTS):
+    '''
+    create the change log and the triggers that write to it. Updates
+    that leave the entry the same are not logged.
+    '''
+    worklog_db.create_tables([EntryChange], safe=True)
+    for operation, event, row in events:
+        when = ''
+        if event == 'UPDATE':
+            when = 'WHEN {} IS NOT {}'.format(change_data('old'), change_data('new'))
+        worklog_db.execute_sql(CHANGE_FEED_TRIGGER.format(
+            operation=operation, event=event, row=row, data=change_data(row),
+            when=when, now="CAST(strftime('%s', 'now') AS INTEGER)"))
+
+
+@contextmanager
+def changes_unlogged(operation):
+    '''
+    inside a transaction, leave one operation on main.entry out of the
+    change log, i.e. moving entries to an archive or compressing their
+    notes does not change them
+    '''
+    worklog_db.execute_sql('DROP TRIGGER IF EXISTS entry_change_{}'.format(operation))
+    try:
+        yield
+    finally:
+        create_change_feed([event for event in CHANGE_FEED_EVENTS
+                            if event[0] == operation])
+
+
+def log_archived_deletes(schema, entry_ids):
+    '''
+    log deleting entries from an archive, which has no triggers as they
+    cannot write to the main database
+    '''
+    worklog_db.execute_sql(
+        'INSERT INTO main.entry_change (operation, entry_id, changed_at, data) '
+        "SELECT 'delete', id, CAST(strftime('%s', 'now') AS INTEGER), {data} "
+        'FROM "{schema}".entry WHERE id IN ({ids})'.format(
+            data=change_data('entry'), schema=schema,
+            ids=', '.join('?' * len(entry_ids))), entry_ids)
+
+
+def last_change():
+    '''the seq of the newest change ever logged, 0 before the first'''
+    row = worklog_db.execute_sql("SELECT seq FROM sqlite_sequence "
+                                 "WHERE name = 'entry_change'").fetchone()
+    return row[0] if row else 0
+
+
+def changes_after(seq=0, limit=Constants.CHANGE_BATCH_SIZE):
+    '''
+    the changes logged after seq, oldest first and at most limit of them,
+    as (seq, operation, entry id, changed at, entry dict) tuples. Pass
+    the seq of the last change to get the next batch. Raises ValueError
+    when some of the changes after seq have been compacted away, the
+    consumer then has to read every entry again.
+    '''
+    first = EntryChange.select(fn.MIN(EntryChange.seq)).scalar() or last_change() + 1
+    if seq + 1 < first:
+        raise ValueError('Changes up to {} have been compacted, read every entry '
+                         'again and continue from {}'.format(first - 1, last_change()))
+    changes = (EntryChange
+               .select()
+               .where(EntryChange.seq > seq)
+               .order_by(EntryChange.seq)
+               .limit(limit)
+               .tuples())
+    return [(seq, operation, entry_id, changed_at, change_entry(data))
+            for seq, operation, entry_id, changed_at, data in changes]
+
+
+def change_entry(data):
+    '''an entry as logged in the change log, with its notes as text'''
+    entry = json.loads(data)
+    if isinstance(entry.get('notes'), dict):
+        entry['notes'] = Entry.notes.python_value(bytes.fromhex(entry['notes']['zlib']))
+    return entry
+
+
+def compact_changes(keep_days=Constants.CHANGE_KEEP_DAYS):
+    '''delete the changes logged more than keep_days ago, returns how many'''
+    cutoff = (datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) -
+              datetime.timedelta(days=keep_days))
+    return EntryChange.delete().where(EntryChange.changed_at < cutoff).execute()
+
+
+def rebuild_search_index():
+    '''re-index every entry, e.g. for a database written by an older version'''
+    with worklog_db.atomic():
+        fill_search_index()
+        EntryIndex.optimize()
+    search_cache.invalidate()
+
+
+@retry_on_lock
+def compress_batch(schema, rows):
+    '''
+    store the notes of (id, notes) rows compressed, in one transaction.
+    A row whose notes changed since they were read is left alone.
+    '''
+    updates = []
+    for entry_id, notes in rows:
+        stored = Entry.notes.db_value(notes)
+        if isinstance(stored, bytes):
+            updates.append((stored, entry_id, notes))
+    prefix = '"{}".'.format(schema) if schema else ''
+    # the archives have no change log triggers
+    unlogged = changes_unlogged('update') if schema is None else nullcontext()
+    with worklog_db.atomic(), unlogged, partition(schema):
+        worklog_db.connection().executemany(
+            'UPDATE {}entry SET notes = ? WHERE id = ? AND notes IS ?'.format(prefix),
+            updates)
+    return len(updates)
+
+
+def compress_notes(batch_size=Constants.NOTES_COMPRESS_BATCH):
+    '''
+    compress the notes stored as text before compression was turned on,
+    in the main database and each archive. Each batch of rows is its own
+    short transaction so the work log stays usable while it runs, and
+    it can be stopped and run again. Returns the number compressed.
+    '''
+    limit = Constants.NOTES_COMPRESS_BYTES
+    if limit is None:
+        return 0
+    compressed = 0
+    for schema in search_partitions():
+        after = 0
+        while True:
+            with partition(schema):
+                rows = list(Entry
+                            .select(Entry.id, Entry.notes)
+                            .where((Entry.id > after) &
+                                   (fn.typeof(Entry.notes) == 'text') &
+                                   (fn.length(Entry.notes.cast('BLOB')) > limit))
+                            .order_by(Entry.id)
+                            .limit(batch_size)
+                            .tuples())
+            if not rows:
+                break
+            compressed += compress_batch(schema, rows)
+            after = rows[-1][0]
+    return compressed
+
+
+def add_entry_indexes(migrator):
+    '''migration 1 - index the columns used by the find_by_* searches'''
+    migrate(
+        migrator.add_index('entry', ('employee_name',), False),
+        migrator.add_index('entry', ('date_started', 'employee_name'), False),
+        migrator.add_index('entry', ('time_taken', 'employee_name'), False),
+    )
+
+
+def add_employee_directory(migrator):
+    '''
+    migration 2 - build the employee directory from the names already
+    logged and point every entry at its employee id.
+    '''
+    worklog_db.create_tables([Employee], safe=True)
+    migrate(migrator.add_column('entry', 'employee_id', Entry.employee))
+    # the first spelling logged for a name becomes the directory name
+    worklog_db.execute_sql('INSERT OR IGNORE INTO employee (name, name_key) '
+                           'SELECT employee_name, employee_key(employee_name) '
+                           'FROM entry ORDER BY id')
+    worklog_db.execute_sql('UPDATE entry SET employee_id = '
+                           '(SELECT id FROM employee '
+                           'WHERE name_key = employee_key(entry.employee_name))')
+    migrate(migrator.add_index('entry', ('employee_id', 'employee_name'), False))
+
+
+def add_search_index(migrator):
+    '''migration 3 - full text index for find_by_lookup'''
+    create_search_index()
+    fill_search_index()
+
+
+def add_time_summaries(migrator):
+    '''migration 4 - per employee / period totals for the reports'''
+    worklog_db.create_tables([TimeSummary], safe=True)
+    rebuild_summaries([None])
+
+
+STORED_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+                       '%Y-%m-%d', '%d/%m/%y %H:%M')
+
+
+def parse_stored_date(value):
+    '''
+    read a date as stored by an older version - text in one of the
+    STORED_DATE_FORMATS, or already epoch seconds
+    '''
+    if isinstance(value, (int, float)):
+        return Entry.date_started.python_value(value)
+    for date_format in STORED_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value).strip(), date_format)
+        except ValueError:
+            pass
+    raise ValueError('Unknown date format {!r}'.format(value))
+
+
+def store_epoch_timestamps(migrator):
+    '''
+    migration 5 - dates were stored as text in whatever format they were
+    given ('01/05/17 09:15' next to '2017-05-01 12:15:00'), so they sorted
+    and compared wrongly. Rewrite them as epoch seconds and drop
+    time_string, which is worked out from time_taken when read.
+    '''
+    cursor = worklog_db.execute_sql(
+        "SELECT id, date_started, date_completed FROM entry "
+        "WHERE typeof(date_started) != 'integer' "
+        "OR typeof(date_completed) != 'integer'")
+    rows = []
+    for entry_id, date_started, date_completed in cursor:
+        try:
+            rows.append((Entry.date_started.db_value(parse_stored_date(date_started)),
+                         Entry.date_completed.db_value(parse_stored_date(date_completed)),
+                         entry_id))
+        except ValueError as error:
+            raise ValueError('Entry {}: {}'.format(entry_id, error))
+    for batch in chunked(rows, 1000):
+        worklog_db.connection().executemany(
+            'UPDATE entry SET date_started = ?, date_completed = ? WHERE id = ?', batch)
+
+    migrate(migrator.drop_column('entry', 'time_string'))
+    # older SQLite copies the table to drop a column, losing the triggers
+    create_search_index()
+    # entries with a date SQLite could not read were left out until now
+    rebuild_summaries([None])
+
+
+def add_archive_catalogue(migrator):
+    '''migration 6 - the list of months moved to archive files'''
+    worklog_db.create_tables([ArchivedMonth], safe=True)
+
+
+def add_change_feed(migrator):
+    '''migration 7 - the change log read by incremental sync jobs'''
+    create_change_feed()
+
+
+def add_compressed_notes(migrator):
+    '''
+    migration 8 - notes may be stored compressed, so the search index
+    keeps its own copy of the text. The rows already stored stay as
+    they are, compress_notes compresses them later.
+    '''
+    recreate_search_index()
+    for operation, _, _ in CHANGE_FEED_EVENTS:
+        worklog_db.execute_sql('DROP TRIGGER IF EXISTS entry_change_{}'.format(operation))
+    create_change_feed()
+
+
+def rekey_employees(migrator):
+    '''
+    migration 9 - migration 2 keyed the directory with SQLite's UPPER(),
+    so a later write could add a second employee for a name like 'José'.
+    Key every employee with employee_key and merge the ones that then
+    share a key - their entries, in the archives too, and summaries.
+    '''
+    kept = {}
+    merged = {}
+    for employee_id, name in (Employee.select(Employee.id, Employee.name)
+                              .order_by(Employee.id).tuples()):
+        kept_id = kept.setdefault(employee_key(name), employee_id)
+        if kept_id != employee_id:
+            merged[employee_id] = kept_id
+
+    fields = [TimeSummary.employee, TimeSummary.period, TimeSummary.period_start,
+              TimeSummary.total_time, TimeSummary.entry_count]
+    for employee_id, kept_id in merged.items():
+        Entry.update(employee=kept_id).where(Entry.employee == employee_id).execute()
+        add_to_summaries(TimeSummary.insert_from(
+            TimeSummary.select(Value(kept_id), TimeSummary.period, TimeSummary.period_start,
+                               TimeSummary.total_time, TimeSummary.entry_count)
+            .where(TimeSummary.employee == employee_id), fields)).execute()
+        TimeSummary.delete().where(TimeSummary.employee == employee_id).execute()
+    if merged:
+        # the migration's transaction could not use every archive, the
+        # ids they are moved to are kept whatever happens to it
+        months = ArchivedMonth.select(ArchivedMonth.month).tuples()
+        for year in sorted({month[:4] for month, in months}):
+            path = archive_path(year)
+            if os.path.exists(path):
+                archive = sqlite3.connect(path)
+                with archive:
+                    archive.executemany('UPDATE entry SET employee_id = ? '
+                                        'WHERE employee_id = ?',
+                                        [(kept_id, employee_id)
+                                         for employee_id, kept_id in merged.items()])
+                archive.close()
+        Employee.delete().where(Employee.id.in_(list(merged))).execute()
+
+    for key, employee_id in kept.items():
+        (Employee.update(name_key=key)
+         .where((Employee.id == employee_id) & (Employee.name_key != key))
+         .execute())
+
+
+def plain_sql_triggers(migrator):
+    '''
+    migration 10 - the search index, its triggers and the change log
+    triggers of migration 8 called notes_text, which only the work log
+    registers, so other tools could not write to entry. They are built
+    again in plain SQL; archives are upgraded when they are attached.
+    '''
+    if not search_index_current():
+        recreate_search_index()
+    for operation, _, _ in CHANGE_FEED_EVENTS:
+        worklog_db.execute_sql('DROP TRIGGER IF EXISTS entry_change_{}'.format(operation))
+    create_change_feed()
+
+
+MIGRATIONS = [
+    (1, add_entry_indexes),
+    (2, add_employee_directory),
+    (3, add_search_index),
+    (4, add_time_summaries),
+    (5, store_epoch_timestamps),
+    (6, add_archive_catalogue),
+    (7, add_change_feed),
+    (8, add_compressed_notes),
+    (9, rekey_employees),
+    (10, plain_sql_triggers),
+]
+
+
+def migrate_database():
+    '''
+    create the tables for a new database, or run any migrations newer
+    than the version recorded in an existing one (PRAGMA user_version).
+    Run by worklog_db the first time it connects.
+    '''
+    if not Entry.table_exists():
+        with worklog_db.atomic():
+            worklog_db.create_tables([Employee, Entry, TimeSummary, ArchivedMonth],
+                                     safe=True)
+            create_search_index()
+            create_change_feed()
+            worklog_db.pragma('user_version', SCHEMA_VERSION)
+        return
+
+    version = worklog_db.pragma('user_version')
+    migrator = SqliteMigrator(worklog_db)
+    with worklog_db.atomic():
+        for number, migration in MIGRATIONS:
+            if number > version:
+                migration(migrator)
+        worklog_db.pragma('user_version', SCHEMA_VERSION)
+
+
+def day_range(first_day, last_day):
+    '''
+    the first and last moment of a range of calendar days, for use
+    with a BETWEEN on date_started
+    '''
+    start = datetime.datetime.combine(first_day, datetime.time.min)
+    end = datetime.datetime.combine(last_day, datetime.time.max.replace(microsecond=0))
+    return start, end
+
+
+def parse_day(date_input):
+    '''read a dd/mm/yy calendar date'''
+    try:
+        return datetime.datetime.strptime(date_input, '%d/%m/%y').date()
+    except (TypeError, ValueError):
+        raise ValueError('\nInvalid entry. The date entered must use '
+                         'the format dd/mm/yy\n')
+
+
+def period_range(period, bucket):
+    '''the range of date_started covered by a calendar bucket'''
+    first_day = datetime.datetime.strptime(bucket, '%Y-%m-%d').date()
+    if period == 'day':
+        last_day = first_day
+    elif period == 'week':
+        last_day = first_day + datetime.timedelta(days=6)
+    else:
+        next_month = (first_day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        last_day = next_month - datetime.timedelta(days=1)
+    return day_range(first_day, last_day)
+
+
+def bucket_expression(period):
+    '''SQL expression for the first day of the period an entry started in'''
+    # coerce(False) keeps the bucket as the plain 'YYYY-MM-DD' string
+    if period == 'day':
+        return fn.date(Entry.date_started, 'unixepoch').coerce(False)
+    elif period == 'week':
+        # weeks start on a Monday
+        return fn.date(Entry.date_started, 'unixepoch', 'weekday 0',
+                       '-6 days').coerce(False)
+    elif period == 'year':
+        return fn.strftime('%Y-01-01', Entry.date_started, 'unixepoch').coerce(False)
+    return fn.strftime('%Y-%m-01', Entry.date_started, 'unixepoch').coerce(False)
+
+
+def calendar_buckets(period, before=None, limit=20):
+    '''
+    count the entries and total time per period, newest first, computed
+    with a GROUP BY so no entries are loaded. Pass the oldest bucket of
+    the previous page as before to get the next page.
+    '''
+    bucket = bucket_expression(period)
+    query = (Entry
+             .select(bucket, fn.COUNT(Entry.id), fn.SUM(Entry.time_taken))
+             .group_by(bucket)
+             .order_by(bucket.desc())
+             .limit(limit))
+    if before is not None:
+        # a bucket starts on or before every entry in it, so this
+        # excludes the buckets already shown
+        query = query.where(Entry.date_started < before)
+
+    # the newest buckets overall are among the newest of each partition
+    totals = {}
+    for schema in search_partitions():
+        with partition(schema):
+            rows = list(query.tuples())
+        for start, count, total in rows:
+            old_count, old_total = totals.get(start, (0, 0))
+            totals[start] = (old_count + count, old_total + total)
+    return [(start,) + totals[start] for start in sorted(totals, reverse=True)[:limit]]
+
+
+def period_start(period, date_started):
+    '''
+    the first day of the period a task started in, as 'YYYY-MM-DD'.
+    Matches bucket_expression so incremental and rebuilt totals agree.
+    '''
+    day = date_started
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    if period == 'week':
+        day -= datetime.timedelta(days=day.weekday())
+    elif period == 'month':
+        day = day.replace(day=1)
+    elif period == 'year':
+        day = day.replace(month=1, day=1)
+    return day.isoformat()
+
+
+def adjust_summaries(entries, sign=1):
+    '''
+    add (sign=1) or take away (sign=-1) entries from the time summaries.
+    entries are (employee id, date started, time taken) tuples. A change
+    to an entry is the old values taken away and the new ones added.
+    '''
+    totals = {}
+    for employee_id, date_started, time_taken in entries:
+        # entries written without an employee are not summarised, the
+        # same as summary_totals
+        if employee_id is None:
+            continue
+        for period in Constants.CALENDAR_PERIODS.values():
+            key = (employee_id, period, period_start(period, date_started))
+            total, count = totals.get(key, (0, 0))
+            totals[key] = (total + sign * time_taken, count + sign)
+
+    rows = [{'employee': employee_id, 'period': period, 'period_start': start,
+             'total_time': total, 'entry_count': count}
+            for (employee_id, period, start), (total, count) in totals.items()]
+    for batch in chunked(rows, 100):
+        add_to_summaries(TimeSummary.insert_many(batch)).execute()
+    if sign < 0:
+        TimeSummary.delete().where(TimeSummary.entry_count <= 0).execute()
+
+
+def add_to_summaries(insert):
+    '''make an insert into the time summaries add to any existing totals'''
+    return insert.on_conflict(
+        conflict_target=[TimeSummary.employee, TimeSummary.period,
+                         TimeSummary.period_start],
+        update={TimeSummary.total_time: TimeSummary.total_time + EXCLUDED.total_time,
+                TimeSummary.entry_count: TimeSummary.entry_count + EXCLUDED.entry_count})
+
+
+def summary_totals(period):
+    '''
+    the per employee totals for a period worked out from the entries
+    themselves, as a query of (employee id, period, period start,
+    total, count)
+    '''
+    bucket = bucket_expression(period)
+    return (Entry
+            .select(Entry.employee, Value(period), bucket,
+                    fn.SUM(Entry.time_taken), fn.COUNT(Entry.id))
+            .where(bucket.is_null(False) & Entry.employee.is_null(False))
+            .group_by(Entry.employee, bucket))
+
+
+def rebuild_summaries(schemas=None):
+    '''
+    recalculate every time summary from the entries, in the main
+    database and the archives unless schemas says otherwise. The
+    archives are totalled one at a time before the transaction, which
+    could not use them all.
+    '''
+    schemas = schemas or search_partitions()
+    fields = [TimeSummary.employee, TimeSummary.period, TimeSummary.period_start,
+              TimeSummary.total_time, TimeSummary.entry_count]
+    archived = []
+    for schema in schemas:
+        if schema:
+            with partition(schema):
+                for period in Constants.CALENDAR_PERIODS.values():
+                    archived.extend(summary_totals(period).tuples())
+    with worklog_db.atomic():
+        TimeSummary.delete().execute()
+        if None in schemas:
+            for period in Constants.CALENDAR_PERIODS.values():
+                add_to_summaries(TimeSummary.insert_from(summary_totals(period),
+                                                         fields)).execute()
+        # a week can start in an archived month and end in the next
+        for batch in chunked(archived, 100):
+            add_to_summaries(TimeSummary.insert_many(batch, fields)).execute()
+
+
+def check_summaries():
+    '''
+    compare the stored time summaries with totals worked out from the
+    entries. Returns a list of (employee id, period, period start,
+    stored (total, count), actual (total, count)) for each difference.
+    '''
+    schemas = search_partitions()
+    differences = []
+    for period in Constants.CALENDAR_PERIODS.values():
+        actual = {}
+        for schema in schemas:
+            with partition(schema):
+                totals = list(summary_totals(period).tuples())
+            for employee_id, _, start, total, count in totals:
+                old_total, old_count = actual.get((employee_id, start), (0, 0))
+                actual[(employee_id, start)] = (old_total + total, old_count + count)
+        stored = {(employee_id, start): (total, count)
+                  for employee_id, start, total, count
+                  in (TimeSummary
+                      .select(TimeSummary.employee, TimeSummary.period_start,
+                              TimeSummary.total_time, TimeSummary.entry_count)
+                      .where(TimeSummary.period == period)
+                      .tuples().iterator())}
+        for key in sorted(set(actual) | set(stored), key=str):
+            if actual.get(key) != stored.get(key):
+                differences.append((key[0], period, key[1],
+                                    stored.get(key), actual.get(key)))
+    return differences
+
+
+def search_terms(search_query):
+    '''
+    turn what the user typed into an FTS5 query. Words must all match,
+    "quoted text" matches as a phrase and a trailing * matches a prefix
+    e.g. data* finds database. Everything is quoted so characters
+    that mean something to FTS5 are searched for as text.
+    '''
+    terms = []
+    for term in re.findall(r'"[^"]*"|\S+', search_query):
+        prefix = term.endswith('*') and not term.startswith('"')
+        words = ' '.join(re.findall(r'\w+', term))
+        if words:
+            terms.append('"{}"{}'.format(words, '*' if prefix else ''))
+    return ' '.join(terms)
+
+
+@functools.lru_cache(maxsize=Constants.PATTERN_CACHE_SIZE)
+def compile_pattern(pattern):
+    '''compile a search pattern once, however many rows it is tested on'''
+    return re.compile(pattern)
+
+
+@worklog_db.func('regexp')
+def regexp(pattern, value):
+    '''the function SQLite calls for 'value REGEXP pattern' '''
+    if value is None:
+        return False
+    return compile_pattern(pattern).search(value) is not None
+
+
+def pattern_literals(pattern):
+    '''
+    the runs of plain text that any match of the pattern must contain,
+    e.g. 'data(base)?\\s+clean' gives ['data', 'clean']. Alternations
+    and optional parts are skipped as they are not always required.
+    Case insensitive patterns return nothing, LIKE only folds ASCII case.
+    '''
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return []
+
+    literals = []
+
+    def walk(items):
+        run = ''
+        for op, value in items:
+            if op is sre_parse.LITERAL:
+                run += chr(value)
+                continue
+            if run:
+                literals.append(run)
+            run = ''
+            if op is sre_parse.SUBPATTERN:
+                add_flags = value[1]
+                if not add_flags & re.IGNORECASE:
+                    walk(value[-1])
+        if run:
+            literals.append(run)
+
+    walk(parsed)
+    return literals
+
+
+def pattern_query(pattern, fields):
+    '''
+    the where clause for a regex search over fields. The longest literal
+    in the pattern is checked with LIKE first so the python regex only
+    runs on the rows that could possibly match.
+    '''
+    compile_pattern(pattern)
+    where = functools.reduce(operator.or_,
+                             [field.regexp(pattern) for field in fields])
+    literals = pattern_literals(pattern)
+    if literals:
+        literal = max(literals, key=len)
+        prefilter = functools.reduce(operator.or_,
+                                     [field.contains(literal) for field in fields])
+        where = prefilter & where
+    return where
+
+
+def get_employee_ids(employee_names):
+    '''
+    map each name to its directory id with one query, adding any
+    names that are new. Used when saving a batch of entries.
+    '''
+    names = {}
+    for employee_name in employee_names:
+        names.setdefault(employee_key(employee_name), employee_name)
+
+    employee_ids = {}
+    # stay well under SQLite's limit on the number of query parameters
+    for keys in chunked(names, 500):
+        employees = (Employee.select(Employee.id, Employee.name_key)
+                     .where(Employee.name_key.in_(keys)))
+        employee_ids.update({key: id for id, key in employees.tuples()})
+    for key in names:
+        if key not in employee_ids:
+            employee_ids[key] = Employee.insert(name=names[key], name_key=key).execute()
+
+    return {employee_name: employee_ids[employee_key(employee_name)]
+            for employee_name in employee_names}
+
+
+@retry_on_lock
+def save_entries(worklogs):
+    '''
+    write a batch of work logs, as built by add_entry, in one transaction
+    using multi-row inserts. Returns the ids of the new entries.
+    '''
+    with worklog_db.atomic():
+        employee_ids = get_employee_ids([work['Employee Name'] for work in worklogs])
+        rows = [{'employee': employee_ids[work['Employee Name']],
+                 'employee_name': work['Employee Name'],
+                 'completed_task': work['Task Completed'],
+                 'date_started': work['Date Started'],
+                 'date_completed': work['Date Completed'],
+                 'notes': work['Notes'] or '',
+                 'time_taken': work['Time Taken']}
+                for work in worklogs]
+        entry_ids = []
+        inserts = rows
+        # SQLite gives a new row the highest id + 1, which could be the id
+        # of an archived entry if the newest entries were archived
+        archived_id = ArchivedMonth.select(fn.MAX(ArchivedMonth.max_id)).scalar() or 0
+        if rows and archived_id > (Entry.select(fn.MAX(Entry.id)).scalar() or 0):
+            entry_ids.append(Entry.insert(dict(rows[0], id=archived_id + 1)).execute())
+            inserts = rows[1:]
+        # each row binds 7 parameters, keep every insert under the limit
+        for batch in chunked(inserts, 100):
+            last_id = Entry.insert_many(batch).execute()
+            # the rows of one insert are given the ids after the current
+            # highest, in order
+            entry_ids.extend(range(last_id - len(batch) + 1, last_id + 1))
+        index_notes(None, entry_ids)
+        adjust_summaries([(row['employee'], row['date_started'], row['time_taken'])
+                          for row in rows])
+    search_cache.invalidate()
+    return entry_ids
+
+
+@retry_on_lock
+def delete_entries(entry_ids, archives=None):
+    '''
+    delete entries by id from the main database or the archives, taking
+    them out of the time summaries. archives are the archive schemas
+    holding the entries, looked up with archives_holding when not given.
+    A transaction can only use Constants.ARCHIVES_ATTACHED archives, so
+    entries spread over more are deleted in a transaction per group of
+    them, each keeping the summaries right.
+    '''
+    if archives is None:
+        archives = archives_holding(entry_ids)
+    groups = list(chunked(archives, Constants.ARCHIVES_ATTACHED)) or [[]]
+    for number, group in enumerate(groups):
+        schemas = ([None] if number == 0 else []) + list(group)
+        with worklog_db.atomic():
+            for schema in schemas:
+                for batch in chunked(entry_ids, 500):
+                    with partition(schema):
+                        entries = list(Entry
+                                       .select(Entry.employee, Entry.date_started,
+                                               Entry.time_taken)
+                                       .where(Entry.id.in_(batch))
+                                       .tuples())
+                        if schema and entries:
+                            log_archived_deletes(schema, batch)
+                        Entry.delete().where(Entry.id.in_(batch)).execute()
+                    adjust_summaries(entries, sign=-1)
+    search_cache.invalidate()
+
+
+class WriteQueue:
+    '''
+    group commit for writers sharing the process, i.e. the api threads.
+    add and delete queue a write and return a Future straight away. A
+    writer thread takes the writes waiting - up to batch_size of them,
+    collected for at most batch_ms - and saves them in one transaction,
+    then resolves each Future with its result. Once the queue holds
+    size writes add and delete block, so writers are held to the pace
+    of the database. A commit is as durable as the connection profile
+    makes it, use 'durable' to sync every commit to disk.
+    '''
+
+    def __init__(self, size=Constants.WRITE_QUEUE_SIZE,
+                 batch_size=Constants.WRITE_BATCH_SIZE,
+                 batch_ms=Constants.WRITE_BATCH_MS):
+        self.pending = queue.Queue(size)
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.lock = threading.Lock()
+        self.writer = None
+        self.batches = self.writes = 0
+
+    def add(self, work_log, timeout=None):
+        '''queue a work log, the result of the Future is the new entry id'''
+        return self.submit('add', work_log, timeout)
+
+    def delete(self, entry_id, timeout=None):
+        '''queue deleting an entry by id'''
+        return self.submit('delete', entry_id, timeout)
+
+    def flush(self, timeout=None):
+        '''wait until every write queued so far has been committed'''
+        if self.writer is not None:
+            self.submit('flush', None).result(timeout)
+
+    def submit(self, action, value, timeout=None):
+        '''
+        queue a write, starting the writer thread the first time. Raises
+        queue.Full if the queue is still full after timeout seconds.
+        '''
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_loop,
+                                               name='worklog-writer', daemon=True)
+                self.writer.start()
+        future = Future()
+        self.pending.put((action, value, future), timeout=timeout)
+        return future
+
+    def next_batch(self):
+        '''wait for a write, then collect more until the batch is full or due'''
+        batch = [self.pending.get()]
+        due = time.monotonic() + self.batch_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.pending.get(timeout=max(due - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def write_loop(self):
+        while True:
+            writes = [write for write in self.next_batch()
+                      if write[2].set_running_or_notify_cancel()]
+            try:
+                results = self.write_batch(writes)
+            except Exception:
+                # a bad write fails the whole transaction, so save the
+                # writes one at a time and only it reports the error
+                for write in writes:
+                    try:
+                        result, = self.write_batch([write])
+                    except Exception as error:
+                        write[2].set_exception(error)
+                    else:
+                        write[2].set_result(result)
+                continue
+            for (action, value, future), result in zip(writes, results):
+                future.set_result(result)
+
+    @retry_on_lock
+    def write_batch(self, writes):
+        '''save writes in one transaction, returns the result of each'''
+        # the archives the deletes need are found before the transaction,
+        # which could not use them all
+        deleted = [value for action, value, _ in writes if action == 'delete']
+        archives = archives_holding(deleted) if deleted else []
+        results = []
+        with worklog_db.atomic():
+            # runs of adds are saved with multi-row inserts
+            for action, run in itertools.groupby(writes, key=operator.itemgetter(0)):
+                values = [value for _, value, _ in run]
+                if action == 'add':
+                    results.extend(save_entries(values))
+                    continue
+                if action == 'delete':
+                    delete_entries(values, archives)
+                results.extend([None] * len(values))
+        self.batches += 1
+        self.writes += len(writes)
+        return results
+
+
+write_queue = WriteQueue()
+# writes still queued when the program ends are committed first
+atexit.register(write_queue.flush)
+
+
+def parse_minutes(num_minutes):
+    '''
+    read an exact number of minutes e.g. 100, or a range e.g. 100 - 300,
+    and return the first and last minute
+    '''
+    minute_range = re.match(r'^\s*(\d+)\s?(?:-\s?(\d+))?\s*$', num_minutes)
+    if not minute_range:
+        raise ValueError('Invalid entry, you must enter a number or a '
+                         'range of numbers i.e. 100 - 300')
+    first_minute = int(minute_range.group(1))
+    last_minute = int(minute_range.group(2) or first_minute)
+    return first_minute, last_minute
+
+
+# The searches. Each returns an Entry query so it can be displayed,
+# exported or narrowed further without going through the prompts.
+
+def entries_by_employee(employee_id):
+    '''entries logged by an employee in the directory'''
+    entries = Entry.select(*ENTRY_FIELDS).order_by(Entry.employee_name.desc())
+    return entries.where(Entry.employee == employee_id)
+
+
+def entries_by_date(start, end):
+    '''entries started between two datetimes, inclusive'''
+    entries = Entry.select(*ENTRY_FIELDS).order_by(Entry.employee_name.desc())
+    entries = entries.where(Entry.date_started.between(start, end))
+    # carried through every clone of the query, so only the archives
+    # holding these months are searched
+    entries.date_range = (start, end)
+    return entries
+
+
+def entries_by_duration(first_minute, last_minute):
+    '''entries that took between first_minute and last_minute minutes'''
+    low, high = seconds_between(first_minute, last_minute)
+    entries = Entry.select(*ENTRY_FIELDS).order_by(Entry.employee_name.desc())
+    return entries.where(Entry.time_taken.between(low, high))
+
+
+def lookup_snippet(start=Constants.BOLD, end=Constants.ENDC + Constants.GREEN):
+    '''the text around a full text match, the matched words between start and end'''
+    return fn.snippet(SQL('entry_index'), -1, start, end, '...', 10).alias('snippet')
+
+
+def entries_by_lookup(search_query):
+    '''
+    entries whose task or notes match the full text search, best match
+    first, with a highlighted snippet of the matching text
+    '''
+    return (Entry
+            .select(*ENTRY_FIELDS, lookup_snippet())
+            .join(EntryIndex, on=(Entry.id == EntryIndex.rowid))
+            .where(EntryIndex.match(search_terms(search_query)))
+            .order_by(EntryIndex.rank()))
+
+
+def entries_by_pattern(pattern):
+    '''entries whose task, notes or employee name match a regular expression'''
+    fields = (Entry.completed_task, NOTES_TEXT, Entry.employee_name)
+    entries = Entry.select(*ENTRY_FIELDS).order_by(Entry.employee_name.desc())
+    return entries.where(pattern_query(pattern, fields))
+
+
+# format_time_taken in SQL, for the pages and exports that read rows
+# rather than Entry objects
+TIME_STRING = (fn.printf('%.1f hours %.1f minutes', Entry.time_taken / 3600,
+                         Entry.time_taken / 60 - Entry.time_taken / 3600 * 60)
+               .coerce(False).alias('time_string'))
+
+# the columns shown on each line of a page of results, the notes are
+# only read when an entry is opened
+LIST_FIELDS = (Entry.id, Entry.employee_name, Entry.completed_task,
+               Entry.date_started, TIME_STRING)
+
+
+class SearchCache:
+    '''
+    least recently used cache of search results, keyed on the sql and
+    parameters of the query so two searches that normalise to the same
+    query share a result. Every write through save_entries or
+    delete_entries bumps the generation, which empties the cache, and a
+    result computed while a write happened is not stored. Writes by other
+    processes are caught by the seq of the last logged change, which is
+    read before each lookup and is part of the key.
+    '''
+
+    def __init__(self, size=Constants.SEARCH_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.generation = 0
+        self.change = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, query, compute):
+        '''the cached result of query, or compute() when there is none'''
+        sql, params = query.sql()
+        change = last_change()
+        key = (change, sql, tuple(params))
+        with self.lock:
+            if change > self.change:
+                # another connection wrote, nothing cached is current
+                self.change = change
+                self.results.clear()
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key]
+            self.misses += 1
+            generation = self.generation
+
+        result = compute()
+        with self.lock:
+            if (generation == self.generation and change == self.change
+                    and self.size > 0):
+                self.results[key] = result
+                if len(self.results) > self.size:
+                    self.results.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def invalidate(self):
+        '''forget every result, called after each write'''
+        with self.lock:
+            self.generation += 1
+            self.results.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.results), 'limit': self.size,
+                    'generation': self.generation, 'change': self.change,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+search_cache = SearchCache()
+
+
+def archive_schema(year):
+    '''the name an archive file is attached under'''
+    return 'archive_{}'.format(year)
+
+
+def archive_path(year):
+    '''archive files sit next to the main database, one per year'''
+    return '{}_archive_{}.db'.format(os.path.splitext(worklog_db.database)[0], year)
+
+
+def archive_year(schema):
+    '''the year of an archive schema, the reverse of archive_schema'''
+    return schema[len('archive_'):]
+
+
+def attach_archive(year):
+    '''
+    attach the archive of a year to this thread's connection, once.
+    SQLite allows 10 attached files, so past Constants.ARCHIVES_ATTACHED
+    the archive used longest ago is detached first. An archive read or
+    written in the open transaction cannot be detached until it ends.
+    '''
+    schema = archive_schema(year)
+    attached = [name for _, name, _ in worklog_db.execute_sql('PRAGMA database_list')
+                if name.startswith('archive_')]
+    # the attached archives, the one used longest ago first
+    recent = [name for name in getattr(partition_state, 'recent', []) if name in attached]
+    recent = [name for name in attached if name not in recent] + recent
+    if schema in recent:
+        recent.remove(schema)
+    else:
+        for name in list(recent):
+            if len(recent) < Constants.ARCHIVES_ATTACHED:
+                break
+            try:
+                worklog_db.execute_sql('DETACH DATABASE "{}"'.format(name))
+            except OperationalError:
+                continue
+            recent.remove(name)
+        if len(recent) >= Constants.ARCHIVES_ATTACHED:
+            raise OperationalError('{} cannot be attached, {} archives are already in '
+                                   'use by this transaction'
+                                   .format(archive_path(year), len(recent)))
+        worklog_db.execute_sql('ATTACH DATABASE ? AS "{}"'.format(schema),
+                               (archive_path(year),))
+        if not search_index_current(schema):
+            with worklog_db.atomic():
+                recreate_search_index(schema)
+    partition_state.recent = recent + [schema]
+    return schema
+
+
+def search_partitions(entries=None):
+    '''
+    the schemas a search has to read - None for the main database then
+    each archive holding a month the search can match. An archive is
+    attached when partition() first renders a query against it.
+    Searches with a date_range skip the archives outside it.
+    '''
+    months = ArchivedMonth.select(ArchivedMonth.month)
+    date_range = getattr(entries, 'date_range', None)
+    if date_range:
+        start, end = date_range
+        months = months.where(ArchivedMonth.month.between(start.strftime('%Y-%m'),
+                                                          end.strftime('%Y-%m')))
+    years = sorted({month[:4] for month, in months.tuples()})
+    return [None] + [archive_schema(year) for year in years]
+
+
+def archives_holding(entry_ids):
+    '''
+    the archive schemas that hold any of entry_ids, looked up one archive
+    at a time so any number of them can be searched outside a transaction
+    '''
+    schemas = []
+    for schema in search_partitions()[1:]:
+        for batch in chunked(entry_ids, 500):
+            with partition(schema):
+                if Entry.select(Entry.id).where(Entry.id.in_(batch)).exists():
+                    schemas.append(schema)
+                    break
+    return schemas
+
+
+def partition_rows(query, schemas, order_by=(), descending=False, limit=None):
+    '''
+    run a query against the entries of every schema, optionally sorted
+    by output column names and limited, yielding tuples converted the
+    way peewee would convert the query's columns. The schemas are read
+    Constants.ARCHIVES_ATTACHED at a time, each group as one UNION ALL,
+    and sorted groups are merged.
+    '''
+    order = ' DESC' if descending else ''
+    groups = []
+    for group in chunked(schemas, Constants.ARCHIVES_ATTACHED):
+        arms = []
+        params = []
+        for schema in group:
+            with partition(schema):
+                sql, arm_params = query.sql()
+            arms.append('SELECT * FROM ({})'.format(sql))
+            params.extend(arm_params)
+        sql = ' UNION ALL '.join(arms)
+        if order_by:
+            sql += ' ORDER BY ' + ', '.join('"{}"{}'.format(name, order)
+                                            for name in order_by)
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        groups.append((group, sql, params))
+
+    def group_rows(group, sql, params):
+        # the group may have been detached while an earlier one was read
+        for schema in group:
+            if schema:
+                attach_archive(archive_year(schema))
+        yield from worklog_db.execute_sql(sql, params)
+
+    rows = [group_rows(*group) for group in groups]
+    if len(rows) == 1:
+        rows = rows[0]
+    elif order_by:
+        names = [column.name for column in query._returning]
+        positions = [names.index(name) for name in order_by]
+        # each group is read in full before the next is attached, its
+        # rows are at most limit; SQLite sorts NULL before every value
+        rows = heapq.merge(*[list(group) for group in rows], reverse=descending,
+                           key=lambda row: [(row[position] is not None, row[position])
+                                            for position in positions])
+    else:
+        rows = itertools.chain.from_iterable(rows)
+    if limit is not None:
+        rows = itertools.islice(rows, limit)
+
+    converters = []
+    for column in query._returning:
+        field = column.unwrap() if isinstance(column, Node) else column
+        converters.append(field.python_value if isinstance(field, Field) else None)
+    for row in rows:
+        yield tuple(convert(value) if convert and value is not None else value
+                    for convert, value in zip(converters, row))
+
+
+def entry_count(entries):
+    '''the number of entries a search finds, in the main database and its archives'''
+    entries = entries.order_by()
+
+    def count():
+        total = 0
+        for schema in search_partitions(entries):
+            with partition(schema):
+                total += entries.count()
+        return total
+    return search_cache.get(entries, count)
+
+
+def find_entry(entry_id, columns=ENTRY_FIELDS):
+    '''
+    one entry by id, from the main database or an archive. Only columns
+    are read, i.e. (Entry.id,) to check it exists; the others, by
+    default the notes, are read when they are first used.
+    '''
+    for schema in search_partitions():
+        with partition(schema):
+            entry = Entry.select(*columns).where(Entry.id == entry_id).first()
+        if entry is not None:
+            entry.partition_schema = schema
+            return entry
+    return None
+
+
+def entry_page(entries, after=None, columns=LIST_FIELDS,
+               sort_key=Entry.employee_name, descending=True,
+               page_size=Constants.PAGE_SIZE):
+    '''
+    fetch one page of a search using keyset pagination - after is the
+    (sort value, id) of the last row of the previous page, so each page
+    is a seek on the sort order rather than an OFFSET that re-reads
+    every earlier row. Returns the rows and the key for the next page.
+    '''
+    page = entries.select(*columns, sort_key.alias('sort_key'))
+    if descending:
+        page = page.order_by(sort_key.desc(), Entry.id.desc())
+    else:
+        page = page.order_by(sort_key, Entry.id)
+
+    if after is not None:
+        position = Tuple(sort_key, Entry.id)
+        if descending:
+            page = page.where(position < Tuple(*after))
+        else:
+            page = page.where(position > Tuple(*after))
+
+    page = page.limit(page_size)
+
+    def fetch():
+        schemas = search_partitions(entries)
+        if len(schemas) == 1:
+            return list(page.namedtuples())
+        row_type = namedtuple('Row', [column.name for column in page._returning])
+        return [row_type(*row) for row in
+                partition_rows(page, schemas, ['sort_key', 'id'], descending, page_size)]
+    rows = search_cache.get(page, fetch)
+    next_after = (rows[-1].sort_key, rows[-1].id) if rows else None
+    return rows, next_after
+
+
+def seconds_between(first_minute, last_minute):
+    '''
+    convert a minute range into a range of seconds so the duration
+    searches compare time_taken directly and can use its index.
+    A task of 100 minutes is anything from 6000 to 6059 seconds.
+    '''
+    return first_minute * 60, last_minute * 60 + 59
 
 class WorkLog(Entry):
    # worklogs = []
@@ -49,17 +1704,16 @@ class WorkLog(Entry):
             ('2', self.find_by_date),
             ('3', self.find_by_duration),
             ('4', self.find_by_lookup),
-            ('5', self.worklog_run)
+            ('5', self.find_by_pattern),
+            ('6', self.worklog_run)
             ])
 
-        worklog_db.connect()
-        worklog_db.create_tables([Entry], safe=True)
-
     def worklog_run(self):
         '''Main Worklog Menu'''
         while True:
             Menu(self.main_menu, 'Main Menu').menu_loop()
 
+    @instrumented('add')
     def add_entry(self):
         '''Add an entry'''
         worklogs = []
@@ -95,14 +1749,8 @@ class WorkLog(Entry):
 
     def create_entries(self, worklogs):
         ''' create the submitted entry'''
-        for work in worklogs:
-            Entry.create(employee_name=work['Employee Name'],
-                         completed_task=work['Task Completed'],
-                         date_started=work['Date Started'],
-                         date_completed=work['Date Completed'],
-                         notes=work['Notes'],
-                         time_taken=work['Time Taken'],
-                         time_string=work['Time String'])
+        for saved in [write_queue.add(work_log) for work_log in worklogs]:
+            saved.result()
         print('\nYour work has been saved!')
 
     def modify_entry(self):
@@ -110,11 +1758,14 @@ class WorkLog(Entry):
         pass
 
 
+    @instrumented('delete')
     def delete_entry(self, entry):
         '''Delete an entry'''
         if input('Are you sure [Yn] ').lower() == 'y':
-            entry.delete_instance()
+            write_queue.delete(entry.id).result()
             print("Entry deleted!")
+            return True
+        return False
 
     def view_entries(self):
         '''Search entries'''
@@ -131,15 +1782,9 @@ class WorkLog(Entry):
             try:
                 employee_name = input('\nPlease enter your full name i.e. '
                                       'Stuart McIntosh : ')
-                if re.match(r'[\w]+\s[\w]+', employee_name):
-                    return employee_name
-                else:
-                    raise Exception('\nInvalid entry, you must enter a name '
-                                    'i.e. Stuart McIntosh')
-            except Exception as error:
+                return check_employee_name(employee_name)
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print('Invalid entry, try again!')
 
     def get_task(self):
         '''
@@ -150,17 +1795,9 @@ class WorkLog(Entry):
             try:
                 task = input('Enter task performed. Task Entries '
                              'cannot be more than 30 characters long : ')
-                if task == '':
-                    raise Exception('\nYou must enter a task!')
-                elif len(task) > 30:
-                    raise Exception('\nA task cannot be more '
-                                    'than 30 characters long!')
-                else:
-                    return task
-            except Exception as error:
+                return check_task(task)
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print('Invalid entry, try again!')
 
     def get_date_started(self):
         ''' get the time the employee started the task'''
@@ -168,17 +1805,9 @@ class WorkLog(Entry):
             try:
                 date_input = input('Please enter date and date you started '
                                    'working, please use - dd/mm/yy hh:mm : ')
-                date_started = datetime.datetime.strptime(date_input,
-                                                          '%d/%m/%y %H:%M')
-                if date_started >= datetime.datetime.now():
-                    raise Exception('\nThe start date cannot be in the future!\n')
-                else:
-                    return date_started
-            except Exception as error:
+                return check_date_started(date_input)
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print('\nInvalid entry. The date entered must use '
-                      'the format dd/mm/yy hh:mm\n')
 
     def get_date_completed(self, date_started):
         ''' get the time the employee completed the task'''
@@ -186,30 +1815,13 @@ class WorkLog(Entry):
             try:
                 date_input = input('Please enter the date and time you '
                                    'completed, please use - dd/mm/yy hh:mm : ')
-                date_completed = datetime.datetime.strptime(date_input,
-                                                            '%d/%m/%y %H:%M')
-                if date_completed <= date_started or date_completed >= datetime.datetime.now():
-                    raise Exception('\nThe completed date cannot be before the '
-                                    'start date or after the current date '
-                                    'and time!\n')
-                else:
-                    return date_completed
-            except Exception as error:
+                return check_date_completed(date_input, date_started)
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print('\nInvalid entry. The date entered must use the '
-                      'format dd/mm/yy hh:mm\n')
 
     def get_total_time(self, date_started, date_completed):
         ''' calculate the total time spent on the task'''
-        time_taken = date_completed - date_started
-        time_taken_seconds = time_taken.total_seconds()
-
-        mins, secs = divmod(time_taken_seconds, 60)
-        hours, mins = divmod(mins, 60)
-        time_str = '{} hours {} minutes'.format(hours, mins)
-
-        return round(time_taken_seconds), time_str
+        return total_time(date_started, date_completed)
 
     def get_notes(self):
         '''uses a system command to get end user notes'''
@@ -218,95 +1830,132 @@ class WorkLog(Entry):
         if data:
             return data
 
+    @instrumented('search')
     def find_by_employee(self):
         '''Find entries by employee'''
-        employee_dict = {}
-        employee_dict = OrderedDict(employee_dict)
-        employee_list = []
-        ctr = 1
+        employee_dict = OrderedDict()
 
         clear_screen()
-        worklogs = Entry.select().order_by(Entry.employee_name.desc())
+        employees = (Employee.select(Employee.id, Employee.name)
+                     .order_by(Employee.name.desc()))
 
-        # Fill out a temp dict with a list of all employees - remove duplicates
-        for work_log in worklogs:
-            if work_log.employee_name.upper() not in employee_list:
-                employee_dict.update({str(ctr) : work_log.employee_name})
-                employee_list.append(work_log.employee_name.upper())
-                ctr += 1
+        # the directory is already de-duplicated, number it for the menu
+        for ctr, employee in enumerate(employees, 1):
+            employee_dict.update({str(ctr) : employee})
+        ctr = len(employee_dict) + 1
 
         # print a menu to choose from
         print('Employee List \n')
         for key, value in employee_dict.items():
-            print('{} {}'.format(key, value))
+            print('{} {}'.format(key, value.name))
 
         while True:
             try:
                 employee_id = input('\nPlease select an employee ID from the list : ')
                 if employee_id == '':
-                    raise Exception('Invalid entry, you must select a valid Employee ID : ')
-                elif employee_id.isalpha():
-                    raise Exception('Invalid entry, you must select a valid Employee ID :')
+                    raise ValueError('Invalid entry, you must select a valid Employee ID : ')
+                elif not employee_id.isnumeric():
+                    raise ValueError('Invalid entry, you must select a valid Employee ID :')
                 elif int(employee_id) <= 0 or int(employee_id) >= int(ctr):
-                    raise Exception('Invalid entry, choose an ID'
-                                    'between 1 to {}'.format(ctr))
-                else:
-                    search_query = employee_dict.get(employee_id)
-                    entries = Entry.select().order_by(Entry.employee_name.desc())
-                    entries = entries.where(Entry.employee_name.contains \
-                                        (search_query))
-                    search_message = '\n The following task(s) were logged by {}' \
-                                     ' :\n'.format(search_query)
-                    self.display_worklogs(entries, search_message)
-                    break
-            except Exception as error:
+                    raise ValueError('Invalid entry, choose an ID '
+                                     'between 1 to {}'.format(ctr - 1))
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print('Invalid entry, try again!')
+            else:
+                employee = employee_dict.get(employee_id)
+                entries = entries_by_employee(employee.id)
+                search_message = '\n The following task(s) were logged by {}' \
+                                 ' :\n'.format(employee.name)
+                self.display_worklogs(entries, search_message)
+                break
 
+    @instrumented('search')
     def find_by_date(self):
         '''Find entries by date'''
-        date_dict = {}
-        date_dict = OrderedDict(date_dict)
-        date_list = []
-        ctr = 1
-
         clear_screen()
-        worklogs = Entry.select().order_by(Entry.employee_name.desc())
+        print(Constants.DATE_SEARCH_MENU)
+        while True:
+            choice = input('\nPlease choose an option : ').strip()
+            if choice in ('1', '2'):
+                break
+            print('Invalid entry, you must choose 1 or 2')
 
-        # Fill out a temp dict with a list of current start dates - remove duplicates
-        for work_log in worklogs:
-            if work_log.date_started not in date_list:
-                date_dict.update({str(ctr) : work_log.date_started})
-                date_list.append(work_log.date_started)
-                ctr += 1
+        if choice == '1':
+            self.find_by_date_range()
+        else:
+            self.find_by_calendar()
 
-        # print a menu to choose from
-        print('Task Date List \n')
-        for key, value in date_dict.items():
-            print('{} {}'.format(key, value))
+    def find_by_date_range(self):
+        '''Find entries started between two dates'''
+        first_day = self.get_search_date('Please enter the first date to '
+                                         'search from, please use - dd/mm/yy : ')
+        while True:
+            last_day = self.get_search_date('Please enter the last date to '
+                                            'search to, please use - dd/mm/yy : ')
+            if last_day >= first_day:
+                break
+            print('\nThe last date cannot be before the first date!\n')
+
+        start, end = day_range(first_day, last_day)
+        entries = entries_by_date(start, end)
+        search_message = '\n The following tasks(s) started between {} and {}' \
+                         ' :\n'.format(first_day, last_day)
+        self.display_worklogs(entries, search_message)
 
-        # Get a valid input from the user
+    def find_by_calendar(self):
+        '''
+        Summarise the entries per day, week or month and let the user
+        drill into one of the periods. The counts are grouped by SQLite
+        a page at a time, newest period first.
+        '''
+        while True:
+            period = input('\nSummarise by [d]ay, [w]eek or [m]onth : ').lower().strip()
+            if period in Constants.CALENDAR_PERIODS:
+                period = Constants.CALENDAR_PERIODS[period]
+                break
+            print('Invalid entry, you must choose d, w or m')
+
+        before = None
+        while True:
+            buckets = calendar_buckets(period, before)
+            if not buckets:
+                input(Constants.GREEN + '\n\n No entries met your search criteria. '
+                      'Press enter to continue' + Constants.ENDC)
+                return
+
+            clear_screen()
+            print('Entries per {} \n'.format(period))
+            for ctr, (bucket, count, seconds) in enumerate(buckets, 1):
+                hours, mins = divmod(seconds // 60, 60)
+                print('{} {} | {} entries | {} hours {} minutes'
+                      .format(ctr, bucket, count, hours, mins))
+
+            choice = input('\nChoose a {} to view its entries, n for older '
+                           'periods or q to return : '.format(period)).lower().strip()
+            if choice == 'q':
+                return
+            elif choice == 'n':
+                before = buckets[-1][0]
+            elif choice.isnumeric() and 0 < int(choice) <= len(buckets):
+                bucket = buckets[int(choice) - 1][0]
+                start, end = period_range(period, bucket)
+                entries = entries_by_date(start, end)
+                search_message = '\n The following tasks(s) started in the {} ' \
+                                 'of {} :\n'.format(period, bucket)
+                self.display_worklogs(entries, search_message)
+                return
+            else:
+                print('Invalid entry, try again!')
+
+    def get_search_date(self, prompt):
+        '''get a calendar date to search on from the user'''
         while True:
             try:
-                date_id = input('\nPlease choose a date_id from the list to search entries : ')
-                if date_id == '':
-                    raise Exception('Invalid entry, you must select a valid date_id : ')
-                elif not date_id.isnumeric():
-                    raise Exception('Invalid entry, you must select a valid date_id : ')
-                else:
-                    search_query = date_dict.get(date_id)
-                    entries = Entry.select().order_by(Entry.employee_name.desc())
-                    entries = entries.where(Entry.date_started == search_query)
-                    search_message = '\n The following tasks(s) started on {}' \
-                                     ' :\n'.format(search_query)
-                    self.display_worklogs(entries, search_message)
-                    break
-            except Exception as error:
+                return parse_day(input(prompt))
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print("Invalid entry. Try again!")
 
+    @instrumented('search')
     def find_by_duration(self):
         '''Find entries by time spent'''
         while True:
@@ -314,83 +1963,161 @@ class WorkLog(Entry):
                 num_minutes = input('\n Please enter the exact number, '
                                     'or a range of minutes for a task performed '
                                     '- e.g 100 or 100 - 300 : ')
-                if num_minutes == '' or num_minutes.isalpha():
-                    raise Exception('Invalid entry, you must enter a number :')
-                elif re.match(r'\d+\s?-\s?\d+', num_minutes):
-                    # we have a match on the range on minutes
-                    # split the string on '-' and strip away any spaces
-                    minute_range = num_minutes.strip().split('-')
-                    entries = Entry.select().order_by(Entry.employee_name.desc())
-                    entries = entries.where(Entry.time_taken / 60 \
-                                            >= int(minute_range[0]) \
-                                            & Entry.time_taken / 60 \
-                                            <= int(minute_range[1]))
-                    search_message = '\nThe following tasks where within your time range!'
-                    self.display_worklogs(entries, search_message)
-                    break
-                else:
-                    # check the timesheet list for entries with exact match
-                    entries = Entry.select().order_by(Entry.employee_name.desc())
-                    entries = entries.where((Entry.time_taken / 60) == int(num_minutes))
-                    search_message = '\nThe following tasks matched the time taken!\n'
-                    self.display_worklogs(entries, search_message)
-                    break
-            except Exception as error:
+                first_minute, last_minute = parse_minutes(num_minutes)
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print("Invalid entry. Try again!")
+            else:
+                entries = entries_by_duration(first_minute, last_minute)
+                if first_minute == last_minute:
+                    search_message = '\nThe following tasks matched the time taken!\n'
+                else:
+                    search_message = '\nThe following tasks where within your time range!'
+                self.display_worklogs(entries, search_message)
+                break
 
+    @instrumented('search')
     def find_by_lookup(self):
         '''Find entries by lookup'''
         while True:
             try:
-                search_query = input('Please enter a string you would '
+                search_query = input('Please enter the words you would '
                                      'like to search for i.e. '
-                                     '"'"Completed database cleanup"'" : ')
-                if search_query == '':
-                    raise Exception('Invalid entry, you must enter a '
-                                    'string to search for!')
-                else:
-                    entries = Entry.select().order_by(Entry.employee_name.desc())
-                    entries = entries.where((Entry.completed_task.contains(search_query) | \
-                                             (Entry.notes.contains(search_query))))
-                    search_message = 'The following timesheets met your search criteria!\n'
-                    self.display_worklogs(entries, search_message)
-                    break
-            except Exception as error:
+                                     '"'"Completed database"'", data* : ')
+                if search_terms(search_query) == '':
+                    raise ValueError('Invalid entry, you must enter a '
+                                     'string to search for!')
+            except ValueError as error:
                 print(error)
-            except ValueError:
-                print("Invalid entry. Try again!")
-
-    def display_worklogs(self, entries, message):
-        '''Dispalys all the worklogs defined in a query'''
-        print(message)
-        if entries:
-            for entry in entries:
-                print(Constants.GREEN + '\n' + '*' * 50 + '\n')
-                print(Constants.GREEN + ' Employee Name: {} | Task Completed: {}' \
-                    .format(entry.employee_name, entry.completed_task))
-                print(Constants.GREEN + ' Date Started: {} | Time Taken: {}' \
-                    .format(entry.date_started, entry.time_string))
-                print(Constants.GREEN + ' Notes: {} '.format(entry.notes))
-
-                print('\n' + Constants.ENDC)
-                print('n. next entry')
-                print('d. delete entry')
-                print('q. return to main menu')
-
-                next_action = input('\nChoose Action [Ndq] : ').lower().strip()
-                if next_action == 'q':
-                    break
-                elif next_action == 'd':
-                    self.delete_entry(entry)
-        else:
+            else:
+                entries = entries_by_lookup(search_query)
+                search_message = 'The following timesheets met your search criteria!\n'
+                self.display_worklogs(entries, search_message,
+                                      LIST_FIELDS + (lookup_snippet(),),
+                                      EntryIndex.rank(), descending=False)
+                break
+
+    @instrumented('search')
+    def find_by_pattern(self):
+        '''Find entries by pattern'''
+        while True:
+            try:
+                pattern = input('Please enter a regular expression to search '
+                                'tasks, notes and names for i.e. '
+                                '"'"data(base)?\\s+clean"'" : ')
+                if pattern == '':
+                    raise ValueError('Invalid entry, you must enter a '
+                                     'pattern to search for!')
+                compile_pattern(pattern)
+            except re.error as error:
+                print('Invalid pattern, {}'.format(error))
+            except ValueError as error:
+                print(error)
+            else:
+                entries = entries_by_pattern(pattern)
+                search_message = 'The following timesheets matched your pattern!\n'
+                self.display_worklogs(entries, search_message)
+                break
+
+    @instrumented('display')
+    def display_worklogs(self, entries, message, columns=LIST_FIELDS,
+                         sort_key=Entry.employee_name, descending=True):
+        '''
+        Displays the worklogs defined in a query a page at a time.
+        Only the page being shown is read from the database.
+        '''
+        total = entry_count(entries)
+        if not total:
             input(Constants.GREEN + '\n\n No entries met your search criteria. '
                   'Press enter to continue' + Constants.ENDC)
+            return
+
+        # the key each page starts after, the last one is the current page
+        pages = [None]
+        while True:
+            rows, next_after = entry_page(entries, pages[-1], columns,
+                                          sort_key, descending)
+            if not rows and len(pages) > 1:
+                # the last entries on this page were deleted
+                pages.pop()
+                continue
+
+            clear_screen()
+            print(message)
+            print(Constants.GREEN + ' {} entries found | page {} of {}'
+                  .format(total, len(pages), -(-total // Constants.PAGE_SIZE)))
+            print(Constants.GREEN + '\n' + '*' * 50 + '\n')
+            for ctr, row in enumerate(rows, 1):
+                print(Constants.GREEN + ' {}. {} | {} | {} | {}'
+                      .format(ctr, row.employee_name, row.completed_task,
+                              row.date_started, row.time_string))
+                if getattr(row, 'snippet', None):
+                    print(Constants.GREEN + '    Matched: {} '.format(row.snippet))
+
+            print('\n' + Constants.ENDC)
+            print('1-{}. open entry'.format(len(rows)))
+            print('n. next page')
+            print('p. previous page')
+            print('q. return to main menu')
+
+            next_action = input('\nChoose Action [Npq] : ').lower().strip()
+            if next_action == 'q':
+                break
+            elif next_action == 'p':
+                if len(pages) > 1:
+                    pages.pop()
+            elif next_action.isnumeric() and 0 < int(next_action) <= len(rows):
+                if self.display_entry(rows[int(next_action) - 1].id):
+                    total -= 1
+                    if not total:
+                        break
+            elif len(pages) * Constants.PAGE_SIZE < total:
+                pages.append(next_after)
+
+    def display_entry(self, entry_id):
+        '''
+        Displays a single worklog including its notes.
+        Returns True if the user deleted it.
+        '''
+        entry = find_entry(entry_id)
+        if entry is None:
+            return False
+
+        print(Constants.GREEN + '\n' + '*' * 50 + '\n')
+        print(Constants.GREEN + ' Employee Name: {} | Task Completed: {}' \
+            .format(entry.employee_name, entry.completed_task))
+        print(Constants.GREEN + ' Date Started: {} | Time Taken: {}' \
+            .format(entry.date_started, entry.time_string))
+        print(Constants.GREEN + ' Notes: {} '.format(entry.notes))
+
+        print('\n' + Constants.ENDC)
+        print('d. delete entry')
+        print('b. back to the list')
+
+        if input('\nChoose Action [Bd] : ').lower().strip() == 'd':
+            return self.delete_entry(entry)
+        return False
 
     def quit(self):
         '''Quit Worklog'''
         sys.exit()
 
+def main(argv=None):
+    '''run the work log menu, or a maintenance command'''
+    parser = argparse.ArgumentParser(description='Work log time sheets')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='rebuild the full text search index and exit')
+    parser.add_argument('--compress-notes', action='store_true',
+                        help='compress the long notes stored before compression '
+                             'was turned on and exit, safe to run while in use')
+    args = parser.parse_args(argv)
+
+    if args.rebuild_index:
+        rebuild_search_index()
+        print('The search index has been rebuilt!')
+    elif args.compress_notes:
+        print('{} notes compressed'.format(compress_notes()))
+    else:
+        WorkLog().worklog_run()
+
 if __name__ == '__main__':
-    WorkLog().worklog_run()
+    main()
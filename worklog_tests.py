@@ -1,6 +1,12 @@
 # unit test file for worklog.py
 
+import asyncio
 import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import threading
 import unittest
 from unittest.mock import Mock
 from unittest.mock import patch
@@ -8,6 +14,14 @@ from unittest.mock import patch
 from peewee import *
 
 
+import analytics
+import api
+import archive
+import backup
+import cli
+import exporter
+import reports
+import validation
 import worklog
 
 TEST_WORKLOGS = [
@@ -31,29 +45,37 @@ TEST_WORKLOGS = [
     }
 ]
 
-worklog_test_db = SqliteDatabase('worklog_test.db')
+# the tests share the work log's database handle, pointed at a test file
+worklog_test_db = worklog.worklog_db
+worklog_test_db.init('worklog_test.db', pragmas=worklog.database_profile())
 
 class Entry(Model):
     employee_name = CharField(max_length=255)
     completed_task = CharField(max_length=30)
-    date_started = DateTimeField()
-    date_completed = DateTimeField()
+    date_started = TimestampField(utc=True)
+    date_completed = TimestampField(utc=True)
     notes = TextField()
     time_taken = IntegerField()
-    time_string = CharField()
 
     class Meta:
         database = worklog_test_db
 
 
+def printed(output):
+    '''everything passed to a mocked print, as one string'''
+    return '\n'.join(' '.join(str(arg) for arg in call.args)
+                     for call in output.call_args_list)
+
+
 class WorkLogTests(unittest.TestCase):
     ''''Main test class for WorkLog'''
 
     def setUp(self):
         ''' initalise in memory database to run the tests'''
-        database = worklog_test_db
-        worklog_test_db.connect()
-        worklog_test_db.create_tables([Entry], safe=True)
+        worklog_test_db.connect(reuse_if_open=True)
+
+    def tearDown(self):
+        worklog_test_db.close()
 
     def test_check_user_table(self):
         ''' test to make sure that the database table is created '''
@@ -65,15 +87,16 @@ class WorkLogTests(unittest.TestCase):
         for work in TEST_WORKLOGS:
             Entry.create(employee_name=work['Employee Name'],
                          completed_task=work['Task Completed'],
-                         date_started=work['Date Started'],
-                         date_completed=work['Date Completed'],
+                         date_started=worklog.parse_stored_date(work['Date Started']),
+                         date_completed=worklog.parse_stored_date(work['Date Completed']),
                          notes=work['Notes'],
-                         time_taken=work['Time Taken'],
-                         time_string=work['Time String'])
+                         time_taken=work['Time Taken'])
 
         # test a couple of entries to ensure that waht we stored is what we think
         self.assertEqual(Entry.get().employee_name, TEST_WORKLOGS[0]['Employee Name'])
-        self.assertEqual(Entry.get().date_started, TEST_WORKLOGS[0]['Date Started'])
+        self.assertEqual(Entry.get().date_started,
+                         datetime.datetime.strptime(TEST_WORKLOGS[0]['Date Started'],
+                                                    '%d/%m/%y %H:%M'))
 
     def test_get_employee_name(self):
         ''' Tests to ensure we get a valid employee name back
@@ -96,13 +119,15 @@ class WorkLogTests(unittest.TestCase):
 
     def test_get_date_started(self):
         ''' test to ensure we have a valid date time from the user'''
+        next_year = (datetime.datetime.now() + datetime.timedelta(days=365)) \
+            .strftime('%d/%m/%y %H:%M')
         with unittest.mock.patch('builtins.input',
                                  side_effect=['',
                                               '01-05-17 12:00',
                                               '01.05.17 12:00',
                                               '01/05/2017 12:00',
                                               '0105-17 12:00',
-                                              '12/05/17 12:00',
+                                              next_year,
                                               '01/05/17 25:00',
                                               '01/05/17 09:15']):
 
@@ -113,8 +138,7 @@ class WorkLogTests(unittest.TestCase):
 
     def test_get_date_completed(self):
         ''' test to ensure we have a valid date time from the user'''
-        date_started = datetime.datetime.strptime(Entry.get().date_started,
-                                                  '%d/%m/%y %H:%M')
+        date_started = Entry.get().date_started
         with unittest.mock.patch('builtins.input',
                                  side_effect=['',
                                               '12-05-17 12:00',
@@ -131,11 +155,8 @@ class WorkLogTests(unittest.TestCase):
 
     def test_get_total_time(self):
         ''' test toatl time calculation '''
-        date_completed = datetime.datetime.strptime(Entry.get().date_completed,
-                                                    '%d/%m/%y %H:%M')
-
-        date_started = datetime.datetime.strptime(Entry.get().date_started,
-                                                  '%d/%m/%y %H:%M')
+        date_completed = Entry.get().date_completed
+        date_started = Entry.get().date_started
         time_taken = date_completed - date_started
         time_taken_seconds = time_taken.total_seconds()
         mins, secs = divmod(time_taken_seconds, 60)
@@ -168,41 +189,425 @@ class WorkLogTests(unittest.TestCase):
                                                         '%d/%m/%y %H:%M'))
 
     def test_find_by_duration(self):
-        ''' test find by duration '''
-        num_minutes = '1 - 100'
-        minute_range = num_minutes.strip().split('-')
-        entries = Entry.select().order_by(Entry.employee_name.desc())
-        entries = entries.where(Entry.time_taken / 60
-                                >= int(minute_range[0])
-                                & Entry.time_taken / 60
-                                <= int(minute_range[1]))
-
+        ''' test find by duration, a page of results then back to the menu '''
         date_started = datetime.datetime.strptime(TEST_WORKLOGS[0]['Date Started'],
                                                   '%d/%m/%y %H:%M')
         date_completed = datetime.datetime.strptime(TEST_WORKLOGS[0]['Date Completed'],
                                                     '%d/%m/%y %H:%M')
+        self.assertEqual(worklog.WorkLog().get_total_time(date_started, date_completed),
+                         (TEST_WORKLOGS[0]['Time Taken'], TEST_WORKLOGS[0]['Time String']))
+
+        total = worklog.entry_count(worklog.entries_by_duration(1, 100))
         with unittest.mock.patch('builtins.input',
-                                 side_effect=['', '10', '1 - 100']):
-            self.assertEqual(worklog.WorkLog().get_total_time(date_started, date_completed),
-                             TEST_WORKLOGS[0]['Time Taken'],
-                             TEST_WORKLOGS[0]['Time String'])
+                                 side_effect=['', '10 -', '1 - 100', 'q']) as answers, \
+                unittest.mock.patch('builtins.print') as output:
+            self.assertIsNone(worklog.WorkLog().find_by_duration())
+        self.assertEqual(answers.call_count, 4)
+        shown = printed(output)
+        self.assertIn(' {} entries found'.format(total), shown)
+        self.assertIn(TEST_WORKLOGS[0]['Time String'], shown)
+
+    def test_seconds_between(self):
+        ''' test the minute range is converted to an inclusive range of seconds '''
+        self.assertEqual(worklog.seconds_between(45, 45), (2700, 2759))
+        self.assertEqual(worklog.seconds_between(1, 100), (60, 6059))
+
+    def test_search_terms(self):
+        ''' test the lookup text is turned into a safe FTS5 query '''
+        self.assertEqual(worklog.search_terms('"Completed database" walk*'),
+                         '"Completed database" "walk"*')
+        self.assertEqual(worklog.search_terms('notes:dog OR'), '"notes dog" "OR"')
+        self.assertEqual(worklog.search_terms(' * '), '')
+
+    def test_pattern_literals(self):
+        ''' test the text a pattern must contain is found for the LIKE prefilter '''
+        self.assertEqual(worklog.pattern_literals(r'data(base)?\s+clean'),
+                         ['data', 'clean'])
+        self.assertEqual(worklog.pattern_literals('dog|cat'), [])
+        self.assertEqual(worklog.pattern_literals('(?i)dog'), [])
+
+    def test_import_check_row(self):
+        ''' test an import row is checked with the same rules as the prompts '''
+        now = datetime.datetime(2017, 6, 1)
+        work_log, reason = validation.check_row(TEST_WORKLOGS[0], now)
+        self.assertIsNone(reason)
+        self.assertEqual(work_log['Time Taken'], TEST_WORKLOGS[0]['Time Taken'])
+        self.assertEqual(work_log['Time String'], TEST_WORKLOGS[0]['Time String'])
+
+        bad_row = dict(TEST_WORKLOGS[0], **{'Task Completed': ''})
+        self.assertIsNotNone(validation.check_row(bad_row, now)[1])
+        self.assertIsNotNone(validation.check_row(TEST_WORKLOGS[1], now)[1])
+
+    def test_validation(self):
+        ''' test the fast date parser reads what strptime reads and batches
+        report each rejected row '''
+        for date_input in ('01/05/17 09:15', '1/5/17 9:5', '29/02/16 10:00',
+                           '29/02/17 10:00', '01/05/68 00:00', '01/05/69 00:00',
+                           '01/05/17 24:00', '01/05/2017 09:15', ' 01/05/17 09:15'):
+            try:
+                expected = datetime.datetime.strptime(date_input, '%d/%m/%y %H:%M')
+            except ValueError:
+                expected = None
+            self.assertEqual(validation.read_date(date_input), expected, date_input)
+
+        now = datetime.datetime(2017, 6, 1)
+        rows = [(2, TEST_WORKLOGS[0]), (3, dict(TEST_WORKLOGS[0], **{'Task Completed': ''})),
+                (4, TEST_WORKLOGS[1]), (5, 'not a row')]
+        work_logs, rejected = validation.check_rows(rows, now)
+        self.assertEqual([work_log['Time Taken'] for work_log in work_logs],
+                         [TEST_WORKLOGS[0]['Time Taken']])
+        self.assertEqual([line_num for line_num, _, _ in rejected], [3, 4, 5])
+
+    def test_schema_checked_once(self):
+        ''' test the schema is only checked by the first connection '''
+        with patch('worklog.migrate_database') as migrate_database:
+            worklog.WorkLog()
+            worklog.WorkLog()
+            worklog_test_db.close()
+            Entry.select().count()
+        migrate_database.assert_not_called()
+        self.assertEqual(worklog_test_db.schema_version, worklog.SCHEMA_VERSION)
+
+    def test_api(self):
+        ''' test an entry can be added, found and deleted through the json api '''
+        async def request(port, method, path, body=b''):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('{} {} HTTP/1.1\r\nContent-Length: {}\r\n'
+                         'Connection: close\r\n\r\n'.format(method, path, len(body))
+                         .encode() + body)
+            head, _, payload = (await reader.read()).partition(b'\r\n\r\n')
+            writer.close()
+            return int(head.split()[1]), json.loads(payload)
+
+        async def run_api():
+            work_api = api.WorkLogApi(workers=2)
+            server = await asyncio.start_server(work_api.handle_connection, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                status, entry = await request(port, 'POST', '/entries',
+                                              json.dumps(TEST_WORKLOGS[0]).encode())
+                self.assertEqual(status, 201)
+                self.assertEqual(entry['completed_task'], TEST_WORKLOGS[0]['Task Completed'])
+
+                status, found = await request(port, 'GET', '/entries?minutes=45&limit=100')
+                self.assertIn(entry['id'], [row['id'] for row in found['entries']])
+                status, error = await request(port, 'GET', '/entries?minutes=x')
+                self.assertEqual(status, 400)
+
+                status, deleted = await request(port, 'DELETE', '/entries/{}'.format(entry['id']))
+                self.assertEqual(deleted, {'deleted': entry['id']})
+                status, error = await request(port, 'GET', '/entries/{}'.format(entry['id']))
+                self.assertEqual(status, 404)
+            finally:
+                server.close()
+                work_api.close()
+
+        asyncio.run(run_api())
+
+    def test_delete_without_employee(self):
+        ''' test an entry written without an employee can be deleted '''
+        work = TEST_WORKLOGS[0]
+        entry = Entry.create(employee_name=work['Employee Name'],
+                             completed_task=work['Task Completed'],
+                             date_started=worklog.parse_stored_date(work['Date Started']),
+                             date_completed=worklog.parse_stored_date(work['Date Completed']),
+                             notes=work['Notes'], time_taken=work['Time Taken'])
+        worklog.delete_entries([entry.id])
+        self.assertIsNone(worklog.find_entry(entry.id))
+        self.assertEqual(worklog.check_summaries(), [])
+
+    def test_employee_key(self):
+        ''' test names differing only in non-ASCII case are one employee '''
+        key, = worklog_test_db.execute_sql("SELECT employee_key('Zoë Brontë')").fetchone()
+        self.assertEqual(key, 'ZOË BRONTË')
+        with worklog_test_db.atomic() as transaction:
+            # a duplicate left by keying the directory with UPPER()
+            first = worklog.Employee.create(name='Zoë Brontë', name_key='ZOë BRONTë')
+            second = worklog.Employee.create(name='ZOË BRONTË', name_key='ZOË BRONTË')
+            worklog.rekey_employees(None)
+            self.assertIsNone(worklog.Employee.get_or_none(worklog.Employee.id == second.id))
+            self.assertEqual(worklog.get_employee_ids(['zoë brontë']), {'zoë brontë': first.id})
+            transaction.rollback()
+
+    def test_write_queue(self):
+        ''' test queued writes are committed together and each gets its result '''
+        write_queue = worklog.WriteQueue(batch_ms=200)
+        work_log, _ = validation.check_row(TEST_WORKLOGS[0], datetime.datetime.now())
+        added = [write_queue.add(work_log) for _ in range(3)]
+        bad = write_queue.add(dict(work_log, **{'Time Taken': None}))
+        entry_ids = [future.result(5) for future in added]
+        self.assertEqual(len(set(entry_ids)), 3)
+        self.assertRaises(IntegrityError, bad.result, 5)
+
+        deleted = [write_queue.delete(entry_id) for entry_id in entry_ids]
+        write_queue.flush(5)
+        self.assertTrue(all(future.done() for future in deleted))
+        self.assertIsNone(worklog.find_entry(entry_ids[0]))
+
+    def test_change_feed(self):
+        ''' test inserts and deletes are logged in order after a seq '''
+        seq = worklog.last_change()
+        work_log, _ = validation.check_row(TEST_WORKLOGS[0], datetime.datetime.now())
+        entry_id, = worklog.save_entries([work_log])
+        worklog.delete_entries([entry_id])
+
+        changes = worklog.changes_after(seq)
+        self.assertEqual([(operation, changed_id) for _, operation, changed_id, _, _
+                          in changes], [('insert', entry_id), ('delete', entry_id)])
+        self.assertEqual(changes[0][4]['completed_task'], work_log['Task Completed'])
+        self.assertEqual(worklog.changes_after(changes[0][0], limit=1), changes[1:])
+
+    def test_compressed_notes(self):
+        ''' test long notes are stored compressed and read back when used '''
+        notes = 'Rebuilt the quarterly index ' * 40
+        work_log, _ = validation.check_row(dict(TEST_WORKLOGS[0], Notes=notes),
+                                           datetime.datetime.now())
+        seq = worklog.last_change()
+        entry_id, = worklog.save_entries([work_log])
+        try:
+            stored, = worklog_test_db.execute_sql('SELECT notes FROM entry WHERE id = ?',
+                                                  (entry_id,)).fetchone()
+            self.assertIsInstance(stored, bytes)
+            self.assertLess(len(stored), len(notes))
+            self.assertEqual(worklog.changes_after(seq)[0][4]['notes'], notes.strip())
+
+            entry = worklog.find_entry(entry_id)
+            self.assertNotIn('notes', entry.__data__)
+            self.assertEqual(entry.notes, notes.strip())
+            self.assertEqual(worklog.find_entry(entry_id, (worklog.Entry.id,)).__data__,
+                             {'id': entry_id})
+            for entries in (worklog.entries_by_lookup('quarterly'),
+                            worklog.entries_by_pattern(r'quarterly\s+index')):
+                self.assertIn(entry_id, [entry.id for entry in entries])
+        finally:
+            worklog.delete_entries([entry_id])
+
+    def test_plain_sql_writes(self):
+        ''' test a connection without the work log's functions can write entries '''
+        other = sqlite3.connect('worklog_test.db')
+        try:
+            with other:
+                entry_id = other.execute(
+                    'INSERT INTO entry (employee_name, completed_task, date_started, '
+                    'date_completed, notes, time_taken) VALUES (?, ?, 0, 60, ?, 60)',
+                    ('Stuart McIntosh', 'Reindexed sheets', 'Written by another tool')
+                ).lastrowid
+            self.assertEqual([entry.id for entry in worklog.entries_by_lookup('another tool')],
+                             [entry_id])
+            with other:
+                other.execute('DELETE FROM entry WHERE id = ?', (entry_id,))
+            self.assertEqual(list(worklog.entries_by_lookup('another tool')), [])
+        finally:
+            other.close()
+
+    def test_backup(self):
+        ''' test a snapshot is checked, restored and pruned '''
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = backup.take_snapshot(directory, pages=8, sleep_ms=0)
+            backup.verify_snapshot(snapshot, directory)
+            restored, = backup.restore_snapshot(snapshot, directory,
+                                                os.path.join(directory, 'restored'))
+            count, = sqlite3.connect(restored).execute('SELECT COUNT(*) FROM entry').fetchone()
+            self.assertEqual(count, worklog.Entry.select().count())
+
+            self.assertEqual(backup.prune_snapshots(directory, keep_last=0, keep_daily=0),
+                             [snapshot])
+            self.assertEqual(backup.snapshots(directory), [])
+        self.assertEqual(backup.retained(['20170501T0900Z', '20170501T1000Z',
+                                          '20170502T0900Z', '20170503T0900Z'],
+                                         keep_last=1, keep_daily=2),
+                         {'20170503T0900Z', '20170502T0900Z'})
+
+    @unittest.skipIf(analytics.numpy is None, 'numpy is not installed')
+    def test_duration_snapshot(self):
+        ''' test the numpy snapshot answers the same as the sql reports '''
+        snapshot = analytics.DurationSnapshot.load(cache=False)
+        self.assertEqual(len(snapshot), worklog.Entry.select().count())
+        self.assertEqual(snapshot.histogram(30), reports.duration_histogram(30, workers=1))
+        self.assertEqual(sum(count for _, count in snapshot.employee_totals().values()),
+                         len(snapshot))
+        self.assertEqual(snapshot.between(datetime.date(2017, 5, 1),
+                                          datetime.date(2017, 5, 1)).histogram(30),
+                         reports.duration_histogram(30, first_day=datetime.date(2017, 5, 1),
+                                                    last_day=datetime.date(2017, 5, 1),
+                                                    workers=1))
+
+    def test_instrumentation(self):
+        ''' test statements are recorded even when their rows are not all read '''
+        stats = worklog_test_db.enable_instrumentation(slow_log_path=None)
+        try:
+            worklog.Entry.select().first()
+            worklog.Entry.select().count()
+            worklog.Entry.select(fn.MAX(worklog.Entry.id)).scalar()
+        finally:
+            worklog_test_db.disable_instrumentation()
+        self.assertEqual(stats.totals()[0], 3)
+        self.assertTrue(any('COUNT' in sql for sql in stats.queries))
+        self.assertEqual(sum(record['rows'] for record in stats.queries.values()), 3)
+
+    def test_search_cache(self):
+        ''' test repeated searches are cached until the next write '''
+        cache = worklog.SearchCache(size=1)
+        entries = worklog.entries_by_duration(45, 45)
+        compute = Mock(return_value=1)
+        self.assertEqual(cache.get(entries, compute), 1)
+        self.assertEqual(cache.get(entries.clone(), compute), 1)
+        compute.assert_called_once()
+
+        cache.get(worklog.entries_by_duration(1, 2), compute)
+        cache.invalidate()
+        cache.get(entries, compute)
+        self.assertEqual(cache.stats(), {'size': 1, 'limit': 1, 'generation': 1,
+                                         'change': worklog.last_change(),
+                                         'hits': 1, 'misses': 3, 'evictions': 1})
+
+        # a write on another connection, as another process would make
+        def touch_entry():
+            for change in (1, -1):
+                worklog_test_db.execute_sql('UPDATE entry SET time_taken = time_taken + ? '
+                                            'WHERE id = (SELECT MIN(id) FROM entry)',
+                                            (change,))
+            worklog_test_db.close()
+        writer = threading.Thread(target=touch_entry)
+        writer.start()
+        writer.join()
+        cache.get(entries, compute)
+        self.assertEqual(compute.call_count, 4)
+        self.assertEqual(cache.stats()['change'], worklog.last_change())
+
+    def test_parse_stored_date(self):
+        ''' test the date formats stored by older versions are all read '''
+        date_started = datetime.datetime(2017, 5, 1, 12, 15)
+        self.assertEqual(worklog.parse_stored_date('01/05/17 12:15'), date_started)
+        self.assertEqual(worklog.parse_stored_date('2017-05-01 12:15:00'), date_started)
+        self.assertEqual(worklog.parse_stored_date(1493640900), date_started)
+        self.assertRaises(ValueError, worklog.parse_stored_date, '1st May')
+
+    def test_time_string(self):
+        ''' test the time string worked out in SQL matches the python one '''
+        for time_taken in (0, 59, 2700, 2759, 9900, 90061):
+            self.assertEqual(worklog.Entry.select(worklog.TIME_STRING)
+                             .from_(SQL('(SELECT ? AS time_taken)', [time_taken])
+                                    .alias('t1')).scalar(),
+                             worklog.format_time_taken(time_taken))
+        self.assertEqual(worklog.format_time_taken(2700), TEST_WORKLOGS[0]['Time String'])
+
+    def test_partition(self):
+        ''' test queries read the archive schema only inside partition() '''
+        entries = worklog.entries_by_duration(1, 2)
+        with worklog.partition('archive_2015'):
+            self.assertIn('"archive_2015"."entry"', entries.sql()[0])
+        self.assertNotIn('archive_2015', entries.sql()[0])
+        self.assertEqual(worklog.archive_schema(2015), 'archive_2015')
+        self.assertEqual(list(worklog.partition_rows(entries.select(worklog.Entry.id),
+                                                     [None])),
+                         list(entries.select(worklog.Entry.id).tuples()))
+        # partition() attached an archive file that was never written
+        worklog_test_db.close()
+        os.remove(worklog.archive_path(2015))
+
+    def test_many_archives(self):
+        ''' test more archives than SQLite can attach at once are searched '''
+        years = range(2001, 2013)
+        now = datetime.datetime.now()
+        work_logs = [validation.check_row(dict(TEST_WORKLOGS[0], **{
+            'Date Started': '01/01/{:02d} 09:15'.format(year % 100),
+            'Date Completed': '01/01/{:02d} 10:00'.format(year % 100)}), now)[0]
+                     for year in years]
+        entry_ids = worklog.save_entries(work_logs)
+        try:
+            for year in years:
+                archive.archive_month('{}-01'.format(year))
+            self.assertEqual(len(worklog.search_partitions()), len(years) + 1)
+
+            entries = worklog.entries_by_duration(45, 45)
+            total = worklog.entry_count(entries)
+            rows, _ = worklog.entry_page(entries, page_size=total)
+            self.assertTrue(set(entry_ids) <= {row.id for row in rows})
+            self.assertEqual([(row.sort_key, row.id) for row in rows],
+                             sorted(((row.sort_key, row.id) for row in rows), reverse=True))
+            self.assertEqual(len(list(exporter.export_rows(entries))), total)
+
+            write_queue = worklog.WriteQueue()
+            entry_ids.append(write_queue.add(work_logs[0]).result(5))
+            self.assertIsNotNone(worklog.find_entry(entry_ids[-1]))
+            self.assertEqual(worklog.check_summaries(), [])
+        finally:
+            worklog.delete_entries(entry_ids)
+            (worklog.ArchivedMonth.delete()
+             .where(worklog.ArchivedMonth.month.in_(['{}-01'.format(year) for year in years]))
+             .execute())
+            worklog_test_db.close()
+            for year in years:
+                os.remove(worklog.archive_path(year))
+        self.assertEqual(worklog.check_summaries(), [])
+
+    def test_entry_report(self):
+        ''' test reports added up by worker processes match one query '''
+        month = worklog.bucket_expression('month')
+        report = (worklog.Entry
+                  .select(worklog.Employee.name, month,
+                          fn.SUM(worklog.Entry.time_taken), fn.COUNT(worklog.Entry.id))
+                  .join(worklog.Employee)
+                  .group_by(worklog.Entry.employee, month)
+                  .order_by(month.desc(), worklog.Employee.name))
+        self.assertEqual(reports.entry_report('month', workers=2), list(report.tuples()))
+        self.assertEqual(reports.duration_histogram(30, workers=2),
+                         reports.duration_histogram(30, workers=1))
+
+    def test_entry_report_spellings(self):
+        ''' test one employee spelt two ways is one row, as in the time report '''
+        now = datetime.datetime.now()
+        entry_ids = worklog.save_entries([
+            validation.check_row(dict(TEST_WORKLOGS[0], **{'Employee Name': name}), now)[0]
+            for name in ('Bobby Tables', 'bobby tables')])
+        try:
+            report = reports.entry_report('month', 'BOBBY TABLES', workers=1)
+            self.assertEqual([row[0] for row in report], ['Bobby Tables'])
+            self.assertEqual(report[0][3], 2)
+            self.assertEqual(reports.entry_report('month', workers=1),
+                             list(reports.time_report('month').tuples()))
+        finally:
+            worklog.delete_entries(entry_ids)
+
+    def test_cli_add(self):
+        ''' test an added entry is echoed with the dates search prints '''
+        args = cli.build_parser().parse_args(
+            ['add', '--employee', TEST_WORKLOGS[0]['Employee Name'],
+             '--task', TEST_WORKLOGS[0]['Task Completed'],
+             '--started', TEST_WORKLOGS[0]['Date Started'],
+             '--completed', TEST_WORKLOGS[0]['Date Completed']])
+        with unittest.mock.patch('builtins.print') as output:
+            self.assertEqual(cli.add(args), 0)
+        echoed = json.loads(printed(output))
+        worklog.delete_entries([echoed['Id']])
+        self.assertEqual(echoed['Date Started'], TEST_WORKLOGS[0]['Date Started'])
+        self.assertEqual(echoed['Date Completed'], TEST_WORKLOGS[0]['Date Completed'])
+
+    def test_unknown_employee(self):
+        ''' test a name not in the directory finds nothing '''
+        args = cli.build_parser().parse_args(['search', '--employee', 'Nobody Here'])
+        self.assertEqual(worklog.entry_count(exporter.search_entries(args)), 0)
+        self.assertEqual(reports.entry_report('month', 'Nobody Here', workers=1), [])
+
+    def test_period_start(self):
+        ''' test entries are summarised into the right day, week and month '''
+        date_started = datetime.datetime(2017, 5, 7, 23, 30)
+        self.assertEqual(worklog.period_start('day', date_started), '2017-05-07')
+        self.assertEqual(worklog.period_start('week', date_started), '2017-05-01')
+        self.assertEqual(worklog.period_start('month', date_started), '2017-05-01')
 
     def test_find_by_lookup(self):
-        ''' test find by text serach'''
-        search_query = 'Completed database'
-        entries = Entry.select().order_by(Entry.employee_name.desc())
-        entries = entries.where((Entry.completed_task.contains(search_query) | \
-                                 (Entry.notes.contains(search_query))))
-
-        with unittest.mock.patch('builtins.input',
-                                 side_effect=['', 'Completed database', 'Completed database']):
-            self.assertRaises(ValueError, worklog.WorkLog().find_by_lookup(), '')
-        '''                         
+        ''' test find by text search, a page of results then back to the menu '''
         with unittest.mock.patch('builtins.input',
-                                 side_effect=['', 'Completed database', 'Completed database']):
-            self.assertEqual(worklog.WorkLog().find_by_lookup(),
-                             TEST_WORKLOGS[0]['Task Completed'])
-        '''                     
+                                 side_effect=['', 'Completed database', 'q']) as answers, \
+                unittest.mock.patch('builtins.print') as output:
+            self.assertIsNone(worklog.WorkLog().find_by_lookup())
+        self.assertEqual(answers.call_count, 3)
+        shown = printed(output)
+        self.assertIn('entries found', shown)
+        self.assertIn(TEST_WORKLOGS[0]['Task Completed'], shown)
+        self.assertNotIn(TEST_WORKLOGS[1]['Task Completed'], shown)
 
 if __name__ == '__main__':
     unittest.main()